@@ -0,0 +1,57 @@
+""" Import time of cumulus_process, measured with python -X importtime in fresh interpreters
+
+    python -m benchmarks.bench_imports [budget_ms]
+
+Exits with status 1 if importing cumulus_process.process takes longer than
+the budget (CUMULUS_IMPORT_BUDGET_MS, default 150 ms), or pulls in modules
+that should only be imported on first use
+"""
+import os
+import sys
+import subprocess
+from statistics import median
+
+MODULE = 'cumulus_process.process'
+
+# imported on first use only
+LAZY = ['boto3', 'botocore', 's3transfer', 'run_cumulus_task', 'argparse', 'multiprocessing',
+        'concurrent.futures.process', 'cumulus_process.cli', 'cumulus_process.stream']
+
+BUDGET_MS = float(os.getenv('CUMULUS_IMPORT_BUDGET_MS', 150))
+
+
+def import_time(module=MODULE):
+    """ Cumulative import time of module in ms, and all modules imported, in a fresh interpreter """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                         stderr=subprocess.PIPE, check=True).stderr.decode()
+    modules = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1000
+    return modules[module], modules
+
+
+def eager(modules):
+    """ Lazy modules that were imported """
+    return [m for m in LAZY if m in modules]
+
+
+def bench(repeat=5):
+    """ Median import time in ms, and lazy modules imported """
+    runs = [import_time() for i in range(repeat)]
+    return median(r[0] for r in runs), eager(runs[0][1])
+
+
+def main(budget=BUDGET_MS):
+    elapsed, imported = bench()
+    print('import %s: %.1f ms (budget %.1f ms)' % (MODULE, elapsed, budget))
+    if imported:
+        print('imported eagerly: %s' % ', '.join(imported))
+    return 1 if elapsed > budget or imported else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[float(a) for a in sys.argv[1:]]))
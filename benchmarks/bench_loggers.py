@@ -0,0 +1,75 @@
+""" Micro-benchmark of CumulusFormatter against the previous python-json-logger formatter
+
+    python -m benchmarks.bench_loggers [records]
+"""
+import sys
+import logging
+import datetime
+import timeit
+from cumulus_process.loggers import CumulusFormatter, ContextAdapter
+
+try:
+    from pythonjsonlogger import jsonlogger
+except ImportError:
+    jsonlogger = None
+
+
+if jsonlogger is not None:
+    class LegacyFormatter(jsonlogger.JsonFormatter):
+        """ CumulusFormatter as of 1.6.0 """
+
+        def format(self, record):
+            if isinstance(record.msg, str):
+                record.msg = {'message': record.msg}
+            if 'message' not in record.msg.keys():
+                record.msg['message'] = ''
+            record.msg['timestamp'] = datetime.datetime.now().isoformat()
+            if hasattr(record, 'collectionName'):
+                record.msg['collectionName'] = record.collectionName
+            if hasattr(record, 'granuleId'):
+                record.msg['granuleId'] = record.granuleId
+            record.msg['level'] = record.levelname
+            return super(LegacyFormatter, self).format(record)
+
+
+class NullStream(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def logger(formatter, adapter):
+    """ Logger writing formatted records to a null stream, with bound context """
+    log = logging.getLogger('bench.%s' % formatter.__class__.__name__)
+    log.propagate = False
+    log.handlers = []
+    handler = logging.StreamHandler(NullStream())
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(formatter)
+    log.addHandler(handler)
+    log.setLevel(1)
+    return adapter(log, {'collectionName': 'MOD09GQ', 'granuleId': 'MOD09GQ.A2017025.h21v00.006'})
+
+
+def bench(log, number):
+    """ Seconds per record for string, dict and filtered (debug) messages """
+    results = {}
+    results['string'] = timeit.timeit(lambda: log.info('Downloaded file'), number=number) / number
+    results['dict'] = timeit.timeit(lambda: log.info({'message': 'Uploaded', 'bytes': 1024}), number=number) / number
+    results['filtered'] = timeit.timeit(lambda: log.debug('Not written'), number=number) / number
+    return results
+
+
+def main(number=100000):
+    runs = [('CumulusFormatter', logger(CumulusFormatter(), ContextAdapter))]
+    if jsonlogger is not None:
+        runs.append(('LegacyFormatter', logger(LegacyFormatter(), logging.LoggerAdapter)))
+    for name, log in runs:
+        results = bench(log, number)
+        print('%-18s' % name + ''.join('%10s: %6.2f us' % (k, v * 1e6) for k, v in results.items()))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,114 @@
+""" Run the benchmark suite, write results as JSON, and compare them to a baseline
+
+    python -m benchmarks.run [--only NAME ...] [--scale 1.0] [--repeat 3]
+                             [--output results.json] [--baseline benchmarks/baseline.json]
+                             [--tolerance 0.5] [--save-baseline]
+
+S3 benchmarks need an S3 endpoint set with LOCALSTACK_HOST (LocalStack, or
+moto in server mode: moto_server -p 4566), they are skipped otherwise.
+Exits with status 1 if any result regressed by more than tolerance.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from statistics import median
+from benchmarks.suite import BENCHMARKS, run
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='cumulus_process benchmarks')
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help='Benchmarks to run (default all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Scale of sizes and counts (default 1.0)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each benchmark, the median is kept (default 3)')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline results to compare to (default %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed slowdown relative to the baseline (default %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save results as the new baseline, from a full run with an S3 endpoint')
+    parsed = parser.parse_args(args)
+    # the metadata of a baseline describes the single run all of its results come from
+    if parsed.save_baseline and parsed.only:
+        parser.error('--save-baseline needs all benchmarks, not --only')
+    if parsed.save_baseline and not os.getenv('LOCALSTACK_HOST'):
+        parser.error('--save-baseline needs LOCALSTACK_HOST set to an S3 endpoint')
+    return parsed
+
+
+def metadata(scale):
+    """ Environment the benchmarks ran in """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        's3': os.getenv('LOCALSTACK_HOST'),
+        'scale': scale,
+    }
+
+
+def run_all(names, scale=1.0, repeat=3):
+    """ Run benchmarks `repeat` times, returning the median of each result by name """
+    results = {}
+    for name in names:
+        if BENCHMARKS[name][1] and not os.getenv('LOCALSTACK_HOST'):
+            print('%-24s skipped, set LOCALSTACK_HOST to an S3 endpoint' % name)
+            continue
+        runs = [run(name, scale) for i in range(repeat)]
+        for i, r in enumerate(runs[0]):
+            r['value'] = median(results_[i]['value'] for results_ in runs)
+            print('%-24s %12.3f %s' % (r['name'], r['value'], r['unit']))
+            results[r.pop('name')] = r
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Names of results worse than the baseline by more than tolerance """
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None or not base['value']:
+            continue
+        ratio = r['value'] / base['value']
+        if r['higher_is_better']:
+            ratio = 1 / ratio if ratio else float('inf')
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            print('REGRESSION %s: %.3f %s, baseline %.3f' % (name, r['value'], r['unit'], base['value']))
+    return regressions
+
+
+def main(args=None):
+    args = parse_args(sys.argv[1:] if args is None else args)
+    scale = args.scale
+    results = run_all(args.only or list(BENCHMARKS), scale=scale, repeat=args.repeat)
+    output = {'meta': metadata(scale), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('scale') != scale:
+            print('Baseline was run at scale %s, not comparing' % baseline['meta'].get('scale'))
+        else:
+            regressions = compare(results, baseline['results'], args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
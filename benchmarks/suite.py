@@ -0,0 +1,181 @@
+""" Benchmarks of cumulus_process, each returning a list of results (see result) """
+import os
+import json
+import gzip
+import time
+import uuid
+import shutil
+import threading
+from tempfile import mkdtemp
+from cumulus_process import s3, helpers, handlers, Process
+from cumulus_process.loggers import CumulusFormatter, ContextAdapter
+from benchmarks import bench_loggers, bench_imports
+
+MB = 1024 ** 2
+
+
+def result(name, value, unit, higher_is_better=False):
+    """ A benchmark result """
+    return {'name': name, 'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def timed(func, *args, **kwargs):
+    """ Seconds taken by func(*args, **kwargs) """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def write_file(fname, size):
+    """ Write a file of size pseudo-random bytes (not compressible) """
+    block = os.urandom(min(size, MB))
+    with open(fname, 'wb') as f:
+        for i in range(0, size, len(block)):
+            f.write(block[:size - i])
+    return fname
+
+
+class Bucket(object):
+    """ Temporary S3 bucket, emptied and removed on exit """
+
+    def __enter__(self):
+        self.name = 'benchmark-%s' % uuid.uuid4()
+        s3.get_client().create_bucket(Bucket=self.name)
+        return self
+
+    def __exit__(self, *exc):
+        s3.delete_prefix('s3://%s/' % self.name)
+        s3.get_client().delete_bucket(Bucket=self.name)
+        return False
+
+
+def bench_s3_transfers(scale, path):
+    """ Upload and download throughput by object size """
+    results = []
+    with Bucket() as bucket:
+        for size in [max(1, int(s * scale)) * MB for s in (1, 16, 64)]:
+            fname = write_file(os.path.join(path, 'object-%s' % size), size)
+            uri = 's3://%s/transfers/%s' % (bucket.name, os.path.basename(fname))
+            elapsed = timed(s3.upload, fname, uri, extra={})
+            results.append(result('s3_upload_%sMB' % (size // MB), size / MB / elapsed, 'MB/s', True))
+            os.remove(fname)
+            elapsed = timed(s3.download, uri, path=path, extra={})
+            results.append(result('s3_download_%sMB' % (size // MB), size / MB / elapsed, 'MB/s', True))
+            os.remove(fname)
+    return results
+
+
+def bench_fetch(scale, path):
+    """ Process.fetch time by number of input files """
+    results = []
+    with Bucket() as bucket:
+        for count in [max(1, int(c * scale)) for c in (10, 100)]:
+            uris = ['s3://%s/fetch/input-%s.txt' % (bucket.name, i) for i in range(count)]
+            for uri in uris:
+                s3.get_client().put_object(Bucket=bucket.name, Key=s3.uri_parser(uri)['key'], Body=b'x' * 1024)
+            process = Process(uris, path=mkdtemp(dir=path), config={'input_keys': {'input': r'^input-.*\.txt$'}})
+            elapsed = timed(process.fetch, 'input', concurrency=8)
+            process.clean_all()
+            results.append(result('fetch_%s_files' % count, elapsed, 's'))
+    return results
+
+
+def bench_dict_to_xml(scale, path):
+    """ XML serialization of metadata with a large boundary """
+    points = [{'PointLongitude': i * 0.001, 'PointLatitude': i * 0.002} for i in range(max(1, int(50000 * scale)))]
+    meta = {'Granule': {'GranuleUR': 'granule', 'Spatial': {'Boundary': {'Points': points}}}}
+    return [
+        result('dict_to_xml', timed(helpers.dict_to_xml, meta), 's'),
+        result('dict_to_xml_pretty', timed(helpers.dict_to_xml, meta, pretty=True), 's'),
+    ]
+
+
+def bench_gunzip(scale, path):
+    """ Decompression throughput of a large file """
+    size = max(1, int(64 * scale)) * MB
+    fname = os.path.join(path, 'big.bin.gz')
+    block = os.urandom(MB // 2) * 2
+    with gzip.open(fname, 'wb', compresslevel=1) as f:
+        for i in range(size // len(block)):
+            f.write(block)
+    elapsed = timed(helpers.gunzip, fname, remove=True)
+    os.remove(os.path.join(path, 'big.bin'))
+    return [result('gunzip_%sMB' % (size // MB), size / MB / elapsed, 'MB/s', True)]
+
+
+def bench_formatter(scale, path):
+    """ Cost of a JSON log line with bound context """
+    log = bench_loggers.logger(CumulusFormatter(), ContextAdapter)
+    results = bench_loggers.bench(log, max(1, int(20000 * scale)))
+    return [result('log_%s' % name, value * 1e6, 'us') for name, value in results.items()]
+
+
+class StubSFN(object):
+    """ Step Functions activity API serving count tasks from memory """
+
+    def __init__(self, count):
+        self.count = count
+        self.done = 0
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.tasks = [{'taskToken': str(i), 'input': json.dumps({'value': i})} for i in range(count)]
+
+    def get_activity_task(self, activityArn, workerName):
+        with self.lock:
+            if self.tasks:
+                return self.tasks.pop()
+        return {}
+
+    def send_task_heartbeat(self, taskToken):
+        pass
+
+    def send_task_success(self, taskToken, output):
+        self._done()
+
+    def send_task_failure(self, taskToken, error, cause):
+        self._done()
+
+    def _done(self):
+        with self.lock:
+            self.done += 1
+            if self.done == self.count:
+                self.finished.set()
+
+
+def bench_activity(scale, path):
+    """ Activity loop task throughput with a stubbed Step Functions """
+    results = []
+    count = max(1, int(500 * scale))
+    for workers in (1, 4):
+        sfn = StubSFN(count)
+        elapsed = timed(handlers.activity, lambda event: event, 'arn', workers=workers, sfn=sfn, stop=sfn.finished)
+        results.append(result('activity_%s_workers' % workers, count / elapsed, 'tasks/s', True))
+    return results
+
+
+def bench_import_time(scale, path):
+    """ Import time of cumulus_process.process in a fresh interpreter """
+    elapsed, imported = bench_imports.bench()
+    return [result('import_ms', elapsed, 'ms')]
+
+
+# all benchmarks, by name, and whether they need an S3 endpoint
+BENCHMARKS = {
+    's3_transfers': (bench_s3_transfers, True),
+    'fetch': (bench_fetch, True),
+    'dict_to_xml': (bench_dict_to_xml, False),
+    'gunzip': (bench_gunzip, False),
+    'formatter': (bench_formatter, False),
+    'activity': (bench_activity, False),
+    'imports': (bench_import_time, False),
+}
+
+
+def run(name, scale=1.0):
+    """ Run a benchmark in a temporary directory, returning its results """
+    func, _ = BENCHMARKS[name]
+    path = mkdtemp()
+    try:
+        return func(scale, path)
+    finally:
+        shutil.rmtree(path)
@@ -5,7 +5,11 @@ logging.getLogger('boto3').setLevel(logging.CRITICAL)
 logging.getLogger('botocore').setLevel(logging.CRITICAL)
 logging.getLogger('nose').setLevel(logging.CRITICAL)
 logging.getLogger('s3transfer').setLevel(logging.CRITICAL)
-logging.getLogger('dicttoxml').setLevel(logging.CRITICAL)
 
 
-from cumulus_process.process import Process
+def __getattr__(name):
+    """ Import Process on first use, keeping `import cumulus_process` cheap """
+    if name == 'Process':
+        from cumulus_process.process import Process
+        return Process
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,161 @@
+import os
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# FICLONE ioctl, clones a file without copying data on filesystems with reflinks (btrfs, xfs)
+FICLONE = 0x40049409
+
+# cache used by s3.download when none is given, enabled by setting CUMULUS_CACHE_DIR
+_default = None
+
+
+class DownloadCache(object):
+    """ Content-addressed cache of downloaded S3 objects, with a byte budget and LRU eviction
+
+    Objects are keyed by bucket, key and ETag (or version id), populated
+    atomically so the cache directory can be shared by concurrent workers, and
+    reflinked or copied into place on a hit, so files can be modified without
+    changing the cached copy. With hardlink=True hits are hard links to the
+    cached copy instead, which is faster without reflinks but shares its data:
+    files must then be treated as read-only (permissions do not stop root)
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 ** 3, hardlink=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hardlink = hardlink
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(bucket, key, version):
+        """ Cache key for an object version (ETag or version id) """
+        return hashlib.sha256(('%s/%s#%s' % (bucket, key, version)).encode()).hexdigest()
+
+    def filename(self, key):
+        """ Path of the cached copy for key """
+        return os.path.join(self.path, key[0:2], key)
+
+    def fetch(self, key, fout, fill):
+        """ Put cached copy of key at fout, calling fill(fileobj) to populate the cache on a miss
+
+        Returns True on a hit
+        """
+        cached = self.filename(key)
+        if self._link(cached, fout):
+            self._count('hits', os.path.getsize(fout))
+            return True
+        self._count('misses')
+        self.put(key, fill)
+        if not self._link(cached, fout):
+            # evicted by another worker in the meantime
+            with open(fout, 'wb') as f:
+                fill(f)
+        return False
+
+    def put(self, key, fill):
+        """ Populate the cache for key by calling fill(fileobj) """
+        cached = self.filename(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cached), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                fill(f)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, cached)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used files until the cache is within its byte budget """
+        with open(os.path.join(self.path, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            files = []
+            for root, dirs, names in os.walk(self.path):
+                for name in names:
+                    if name.startswith('.'):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+            total = sum(f[1] for f in files)
+            for mtime, size, fname in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(fname)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._count('evictions')
+                logger.debug('Evicted %s from download cache', fname)
+
+    def _link(self, cached, fout):
+        """ Reflink, hard link (if enabled) or copy cached file to fout, returns False if not cached """
+        try:
+            # mark as recently used
+            os.utime(cached)
+        except FileNotFoundError:
+            return False
+        if os.path.lexists(fout):
+            os.remove(fout)
+        try:
+            _reflink(cached, fout)
+            return True
+        except OSError:
+            pass
+        if self.hardlink:
+            try:
+                os.link(cached, fout)
+                return True
+            except FileNotFoundError:
+                return False
+            except OSError:
+                pass
+        try:
+            shutil.copyfile(cached, fout)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _count(self, stat, nbytes=None):
+        with self._lock:
+            self.stats[stat] += 1
+            if nbytes is not None:
+                self.stats['bytes_saved'] += nbytes
+
+
+def _reflink(src, dst):
+    """ Clone src to dst, raising OSError if the filesystem does not support it """
+    with open(src, 'rb') as fin:
+        with open(dst, 'wb') as fout:
+            try:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            except OSError:
+                fout.close()
+                os.remove(dst)
+                raise
+
+
+def get_cache():
+    """ Get the default cache, configured with CUMULUS_CACHE_DIR, CUMULUS_CACHE_BYTES and CUMULUS_CACHE_HARDLINK """
+    global _default
+    path = os.getenv('CUMULUS_CACHE_DIR')
+    if not path:
+        return None
+    if _default is None or _default.path != path:
+        hardlink = os.getenv('CUMULUS_CACHE_HARDLINK', '').lower() in ('1', 'true', 'yes')
+        _default = DownloadCache(path, int(os.getenv('CUMULUS_CACHE_BYTES', 10 * 1024 ** 3)), hardlink=hardlink)
+    return _default
@@ -0,0 +1,74 @@
+import zlib
+import base64
+import hashlib
+
+# algorithms S3 can store as additional checksums, by their S3 name
+S3_ALGORITHMS = {'sha256': 'SHA256', 'sha1': 'SHA1', 'crc32': 'CRC32'}
+
+
+class CRC32(object):
+    """ CRC32 with the same interface as hashlib hashes """
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return '%08x' % self.value
+
+
+def new(algorithm):
+    """ Create a hash for algorithm, crc32 or any hashlib algorithm (e.g. md5, sha256) """
+    if algorithm == 'crc32':
+        return CRC32()
+    return hashlib.new(algorithm)
+
+
+class HashingFile(object):
+    """ File object wrapper hashing data as it is read or written
+
+    The wrapper is deliberately not seekable, so that transfers read or write it in order
+    """
+
+    def __init__(self, fileobj, algorithms):
+        self.fileobj = fileobj
+        self.hashes = {a: new(a) for a in algorithms}
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        for h in self.hashes.values():
+            h.update(data)
+        return data
+
+    def write(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+        return self.fileobj.write(data)
+
+    def hexdigests(self):
+        """ Checksums of data read or written so far, by algorithm """
+        return {a: h.hexdigest() for a, h in self.hashes.items()}
+
+
+def hash_file(filename, algorithms, bufsize=1024 * 1024):
+    """ Checksums of a local file, by algorithm """
+    with open(filename, 'rb') as f:
+        hf = HashingFile(f, algorithms)
+        while hf.read(bufsize):
+            pass
+    return hf.hexdigests()
+
+
+def from_s3(response, algorithms):
+    """ Full object checksums for algorithms stored by S3, from a head_object or get_object response """
+    checksums = {}
+    if response.get('ChecksumType', 'FULL_OBJECT') != 'FULL_OBJECT':
+        return checksums
+    for algorithm in [a for a in algorithms if a in S3_ALGORITHMS]:
+        value = response.get('Checksum%s' % S3_ALGORITHMS[algorithm])
+        # checksums of multipart uploads made of the checksums of each part end with -<parts>
+        if value and '-' not in value:
+            checksums[algorithm] = base64.b64decode(value).hex()
+    return checksums
@@ -6,6 +6,7 @@ import argparse
 import json
 import logging
 from cumulus_process import s3
+from cumulus_process.handlers import HEARTBEAT_INTERVAL
 from cumulus_process.version import __version__
 
 logger = logging.getLogger(__name__)
@@ -28,14 +29,28 @@ def parse_args(cls, args):
     parser = subparsers.add_parser('process', parents=[pparser], help='Process local files', formatter_class=dhf)
     parser.add_argument('input', nargs='*', default=[])
 
+    parser.add_argument('--batch', help='Process each message (list of input files, or payload) of a JSON lines '
+                        'file or S3 prefix (ending with /) in turn', default=None)
+
     recipe_parser = subparsers.add_parser('payload', parents=[pparser], help='Process message', formatter_class=dhf)
-    recipe_parser.add_argument('payload', help='Process message recipe (JSON, S3 address, or local file)')
+    recipe_parser.add_argument('payload', help='Process message recipe (JSON, S3 address, or local file). JSON lines '
+                               'files (.jsonl) and S3 prefixes (ending with /) are processed as a batch of messages')
     recipe_parser.add_argument('--noclean', action='store_true', default=False,
                                help='Do not remove local files when done')
 
+    for p in (parser, recipe_parser):
+        p.add_argument('--workers', help='Number of batch messages processed at the same time (default one per cpu)',
+                       default=None, type=int)
+        p.add_argument('--output', help='JSON lines file for the results of a batch (- for stdout)', default='-')
+
     h = 'Start Step Function Activity'
     activity_parser = subparsers.add_parser('activity', parents=[pparser], help=h, formatter_class=dhf)
     activity_parser.add_argument('--arn', help='ARN for Step Function Activity', default=os.getenv('ACTIVITY_ARN'))
+    activity_parser.add_argument('--workers', help='Number of tasks run at the same time', default=1, type=int)
+    activity_parser.add_argument('--mode', help='Run workers as threads or processes', default='thread',
+                                 choices=['thread', 'process'])
+    activity_parser.add_argument('--heartbeat', help='Seconds between task heartbeats (0 to disable)',
+                                 default=HEARTBEAT_INTERVAL, type=int)
 
     parser0 = cls.add_parser_args(parser0)
 
@@ -59,7 +74,24 @@ def process_payload(payload):
                     payload = json.loads(payload)
                 except:
                     raise ValueError("Invalid payload: %s" % payload)
-    return payload
+    return s3.resolve_pointer(payload)
+
+
+def is_batch(source):
+    """ Check if source is a JSON lines file or an S3 prefix of messages """
+    return source.endswith('.jsonl') or (source[0:5] == 's3://' and source.endswith('/'))
+
+
+def iter_payloads(source):
+    """ Iterate over messages of a JSON lines file, or S3 uris of the messages under an S3 prefix """
+    if source[0:5] == 's3://':
+        for obj in s3.iter_objects(source):
+            yield obj['uri']
+        return
+    with open(source) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
 
 def cli(cls):
@@ -76,20 +108,39 @@ def cli(cls):
         'distribution_endpoint': ''
     }
 
+    # process batches of local files
+    if cmd == 'process' and args['batch'] is not None:
+        # results are written to stdout
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+        payloads = ({'input': m, 'config': config} if isinstance(m, list) else dict({'config': config}, **m)
+                    for m in iter_payloads(args['batch']))
+        return cls.run_many(payloads, workers=args['workers'], output=args['output'], path=args['path'] or None,
+                            noclean=True)
+
     # process local files
-    if cmd == 'process':
+    elif cmd == 'process':
+        for key in ('batch', 'workers', 'output'):
+            args.pop(key)
         logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
         process = cls.run(config=config, noclean=True, **args)
 
+    # process a batch of messages
+    elif cmd == 'payload' and is_batch(args['payload']):
+        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+        return cls.run_many(iter_payloads(args['payload']), workers=args['workers'], output=args['output'],
+                            path=args['path'] or None, noclean=args['noclean'])
+
     # process with a message
     elif cmd == 'payload':
         logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+        args.pop('workers')
+        args.pop('output')
         pl = process_payload(args.pop('payload'))
         output = cls.handler(pl, **args)
 
     # run as a service
     elif cmd == 'activity':
-        cls.cumulus_activity(args['arn'])
+        cls.cumulus_activity(args['arn'], workers=args['workers'], mode=args['mode'], heartbeat=args['heartbeat'])
 
     else:
         logger.error('Unknown command %s (choose between: process, payload, activity)' % cmd)
@@ -0,0 +1,149 @@
+import os
+import time
+import shlex
+import select
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+from cumulus_process.pool import run_all
+
+logger = logging.getLogger(__name__)
+
+# lines of output kept for the result of a command
+TAIL_LINES = 1000
+
+# seconds a command has to exit after SIGTERM before it is killed, and that
+# output is read for after a command without timeout exits
+KILL_GRACE = 5
+
+# seconds between checks that reading output should stop
+READ_POLL = 0.1
+
+
+class CommandError(RuntimeError):
+    """ Command failed or timed out, its result (with the tail of its output) is in `result` """
+
+    def __init__(self, message, result):
+        super(CommandError, self).__init__(message)
+        self.result = result
+
+
+def run_command(cmd, timeout=None, log=None, tail=TAIL_LINES, cwd=None, env=None):
+    """ Run a command (an argv list, or a string split like a shell would), streaming its output to a logger
+
+    Output (stdout and stderr, interleaved) is logged line by line at DEBUG
+    level and only the last `tail` lines are kept. The command and any process
+    it started are terminated if it runs, or keeps its output open (e.g. from
+    a background process), longer than timeout seconds. Without a timeout,
+    output is read for up to KILL_GRACE seconds after the command exits.
+    Returns a dictionary with the command, returncode, output (the tail, as
+    bytes), elapsed seconds, cpu_time (user and system seconds) and max_rss
+    (KiB), and raises a CommandError with it if the command fails
+    """
+    log = log or logger
+    argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    lines = deque(maxlen=tail)
+    start = time.time()
+    deadline = None if timeout is None else start + timeout
+    log.debug(cmd)
+    # in its own session, so the whole process group can be killed
+    proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, env=env,
+                            start_new_session=True)
+    stop = threading.Event()
+
+    def _line(line):
+        lines.append(line)
+        log.debug('%s', line.rstrip().decode(errors='replace'))
+
+    def _read():
+        # read the pipe directly, polling so reading can be stopped while the output is held open
+        fd = proc.stdout.fileno()
+        partial = b''
+        while not stop.is_set():
+            if not select.select([fd], [], [], READ_POLL)[0]:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            *complete, partial = (partial + chunk).split(b'\n')
+            for line in complete:
+                _line(line + b'\n')
+        if partial:
+            _line(partial)
+
+    def _wait():
+        _, status, rusage = os.wait4(proc.pid, 0)
+        exited.update(returncode=os.waitstatus_to_exitcode(status), rusage=rusage)
+
+    exited = {}
+    reader = threading.Thread(target=_read, daemon=True)
+    waiter = threading.Thread(target=_wait, daemon=True)
+    reader.start()
+    waiter.start()
+    waiter.join(_remaining(deadline))
+    timed_out = waiter.is_alive()
+    if timed_out:
+        _kill(proc.pid, waiter)
+    else:
+        # output may be held open by processes the command left running in the background
+        reader.join(KILL_GRACE if deadline is None else _remaining(deadline))
+        if reader.is_alive() and deadline is not None:
+            timed_out = True
+            _killpg(proc.pid, signal.SIGKILL)
+    if timed_out:
+        # output ends once the killed processes are gone
+        reader.join(KILL_GRACE)
+    stop.set()
+    reader.join()
+    proc.stdout.close()
+    # wait4 already reaped the process
+    proc.returncode = exited.get('returncode', -signal.SIGKILL)
+    rusage = exited.get('rusage')
+    result = {
+        'command': cmd,
+        'returncode': proc.returncode,
+        'output': b''.join(lines),
+        'elapsed': time.time() - start,
+        'cpu_time': rusage.ru_utime + rusage.ru_stime if rusage else None,
+        'max_rss': rusage.ru_maxrss if rusage else None,
+    }
+    if timed_out:
+        raise CommandError('Timeout running %s after %ss' % (cmd, timeout), result)
+    if proc.returncode != 0:
+        raise CommandError('Error running %s' % cmd, result)
+    return result
+
+
+def _remaining(deadline):
+    """ Seconds left until deadline, None if there is none """
+    return None if deadline is None else max(deadline - time.time(), 0)
+
+
+def _killpg(pgid, sig):
+    """ Send a signal to a process group, if it still exists """
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def _kill(pgid, waiter):
+    """ Terminate a process group, killing it if still running after KILL_GRACE seconds """
+    for sig, grace in ((signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, None)):
+        _killpg(pgid, sig)
+        waiter.join(grace)
+        if not waiter.is_alive():
+            return
+
+
+def run_commands(cmds, concurrency=None, timeout=None, log=None, tail=TAIL_LINES, cwd=None, env=None):
+    """ Run independent commands in parallel (default one per cpu), returning results in order (see run_command)
+
+    If a command fails, commands not yet started are cancelled and its CommandError is raised
+    """
+    def _run(cmd):
+        return run_command(cmd, timeout=timeout, log=log, tail=tail, cwd=cwd, env=env)
+
+    return run_all(_run, cmds, workers=concurrency or os.cpu_count())
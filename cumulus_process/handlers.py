@@ -1,10 +1,13 @@
 import os
 import json
-import boto3
+import time
+import uuid
+import signal
+import threading
 import traceback
-from botocore.client import Config
-from botocore.vendored.requests.exceptions import ReadTimeout
+from concurrent.futures import ThreadPoolExecutor
 from cumulus_process.loggers import getLogger
+from cumulus_process.s3 import get_client, upload_json, resolve_pointer
 
 logger = getLogger(__name__)
 
@@ -14,34 +17,205 @@ cls is the Process subclass for a specific data source, such as MODIS, ASTER, et
 
 SFN_PAYLOAD_LIMIT = 32768
 
+# S3 prefix outputs larger than SFN_PAYLOAD_LIMIT are written to, and their compression
+SFN_SPILL_URI = os.getenv('SFN_SPILL_URI')
+SFN_SPILL_COMPRESSION = os.getenv('SFN_SPILL_COMPRESSION', 'gzip')
 
-def activity(handler, arn=os.getenv('ACTIVITY_ARN')):
-    """ An activity service for use with AWS Step Functions """
-    sfn = boto3.client('stepfunctions', config=Config(read_timeout=70))
-    while True:
-        get_and_run_task(handler, sfn, arn)
+# seconds between heartbeats sent while an activity task runs (0 to disable)
+HEARTBEAT_INTERVAL = int(os.getenv('ACTIVITY_HEARTBEAT_INTERVAL', 60))
 
+# heartbeat of the task running in the current thread
+_current = threading.local()
 
-def get_and_run_task(handler, sfn, arn):
-    """ Get and run a single task as part of an activity """
+
+class Heartbeat(object):
+    """ Send heartbeats for an activity task from a background thread while it runs """
+
+    def __init__(self, sfn, token, interval=HEARTBEAT_INTERVAL):
+        self.sfn = sfn
+        self.token = token
+        self.interval = interval
+        self.sent = 0
+        self.progress = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __enter__(self):
+        if self.interval:
+            self._thread = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+            self._thread.start()
+        _current.heartbeat = self
+        return self
+
+    def __exit__(self, *args):
+        _current.heartbeat = None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.beat():
+                break
+
+    def beat(self, message=None):
+        """ Send a heartbeat, with optional progress message, returning False once the task is gone """
+        if message is not None:
+            self.progress = message
+            logger.info('Task progress: %s' % message)
+        try:
+            with self._lock:
+                self.sfn.send_task_heartbeat(taskToken=self.token)
+                self.sent += 1
+            return True
+        except Exception as e:
+            logger.warning('Heartbeat failed: %s' % str(e))
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            return code not in ('TaskTimedOut', 'TaskDoesNotExist')
+
+
+def spill(output, uri=None, limit=SFN_PAYLOAD_LIMIT, compression=None):
+    """ Write output to S3 under uri (default SFN_SPILL_URI) if its JSON is larger than limit
+
+    Returns a small pointer to the S3 payload if spilled, otherwise output
+    """
+    uri = uri or SFN_SPILL_URI
+    size = len(json.dumps(output).encode())
+    if size <= limit:
+        return output
+    if not uri:
+        logger.warning('Output of %s bytes is over the %s byte limit, set SFN_SPILL_URI to store it on S3' % (size, limit))
+        return output
+    compression = compression or SFN_SPILL_COMPRESSION
+    ext = {'gzip': '.gz', 'zstd': '.zst'}.get(compression, '')
+    key = '%s/%s.json%s' % (uri.rstrip('/'), uuid.uuid4(), ext)
+    logger.info('Output of %s bytes is over the %s byte limit, writing it to %s' % (size, limit, key))
+    return upload_json(output, key, compression=compression)
+
+
+def heartbeat(message=None):
+    """ Report progress of the activity task running in this thread, if any """
+    hb = getattr(_current, 'heartbeat', None)
+    if hb is None:
+        return False
+    return hb.beat(message)
+
+
+def activity(handler, arn=os.getenv('ACTIVITY_ARN'), workers=1, mode='thread', sfn=None, stop=None,
+             heartbeat=HEARTBEAT_INTERVAL, spill_outputs=True):
+    """ An activity service for use with AWS Step Functions
+
+    Runs `workers` pollers as threads or processes (mode), each running one task
+    at a time, so at most `workers` tasks are in flight. Workers finish their
+    current task and exit once stop is set or on SIGTERM/SIGINT, and a list of
+    stats for each worker is returned. If a worker fails, the others are
+    stopped and its exception is raised. In process mode stop must be
+    shareable with child processes (e.g. multiprocessing.Manager().Event()),
+    and each worker creates its own Step Functions client (sfn can't be given).
+    Heartbeats are sent every `heartbeat` seconds while a task runs, and
+    outputs over SFN_PAYLOAD_LIMIT are written to S3 if spill_outputs is set
+    """
+    if mode not in ('thread', 'process'):
+        raise ValueError('Invalid activity mode %s (choose between: thread, process)' % mode)
+    if mode == 'process' and sfn is not None:
+        raise ValueError('sfn can not be shared with worker processes, each creates its own client')
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    manager = None
+    if stop is None:
+        if mode == 'thread':
+            stop = threading.Event()
+        else:
+            manager = multiprocessing.Manager()
+            stop = manager.Event()
+    previous = _handle_signals(stop)
+    try:
+        if workers == 1 and mode == 'thread':
+            return [worker(handler, arn, stop, sfn=sfn, heartbeat=heartbeat, spill_outputs=spill_outputs)]
+        names = ['%s-%s' % (__name__, i) for i in range(workers)]
+        if mode == 'thread':
+            executor = ThreadPoolExecutor(max_workers=workers)
+            futures = [executor.submit(worker, handler, arn, stop, sfn, name, heartbeat, spill_outputs)
+                       for name in names]
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            futures = [executor.submit(worker, handler, arn, stop, None, name, heartbeat, spill_outputs)
+                       for name in names]
+        with executor:
+            return [f.result() for f in futures]
+    finally:
+        for sig, h in previous.items():
+            signal.signal(sig, h)
+        if manager is not None:
+            manager.shutdown()
+
+
+def _handle_signals(stop):
+    """ Set stop on SIGTERM and SIGINT, returning the previous handlers """
+    previous = {}
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous[sig] = signal.signal(sig, lambda signum, frame: stop.set())
+    return previous
+
+
+def worker(handler, arn, stop, sfn=None, name=__name__, heartbeat=HEARTBEAT_INTERVAL, spill_outputs=True):
+    """ Poll for and run tasks until stop is set, returning stats for this worker """
+    if sfn is None:
+        from botocore.client import Config
+        sfn = get_client('stepfunctions', config=Config(read_timeout=70))
+    stats = {'worker': name, 'polls': 0, 'timeout': 0, 'empty': 0, 'succeeded': 0, 'failed': 0, 'busy': 0.0}
+    started = time.time()
+    try:
+        while not stop.is_set():
+            start = time.time()
+            status = get_and_run_task(handler, sfn, arn, worker=name, heartbeat=heartbeat,
+                                      spill_outputs=spill_outputs)
+            stats['polls'] += 1
+            stats[status] += 1
+            if status in ('succeeded', 'failed'):
+                stats['busy'] += time.time() - start
+    except BaseException:
+        # let the other workers finish cleanly, rather than polling forever
+        stop.set()
+        raise
+    stats['elapsed'] = time.time() - started
+    logger.info('Activity worker %s stopped: %s' % (name, stats))
+    return stats
+
+
+def get_and_run_task(handler, sfn, arn, worker=__name__, heartbeat=HEARTBEAT_INTERVAL, spill_outputs=True):
+    """ Get and run a single task as part of an activity
+
+    Heartbeats are sent every `heartbeat` seconds while the task runs. If
+    spill_outputs is set, outputs over SFN_PAYLOAD_LIMIT are written to S3
+    (see spill), leave it off for Cumulus messages as the next task could not
+    resolve the pointer. Returns the outcome: timeout, empty, succeeded or failed
+    """
+    from botocore.exceptions import ReadTimeoutError
+    from botocore.vendored.requests.exceptions import ReadTimeout
     logger.info('query for task')
     try:
-        task = sfn.get_activity_task(activityArn=arn, workerName=__name__)
-    except ReadTimeout:
+        task = sfn.get_activity_task(activityArn=arn, workerName=worker)
+    except (ReadTimeout, ReadTimeoutError):
         logger.warning('Activity read timed out. Trying again.')
-        return
+        return 'timeout'
 
     token = task.get('taskToken', None)
     if not token:
         logger.info('No activity task')
-        return
+        return 'empty'
 
     try:
-        payload = json.loads(task['input'])
+        payload = resolve_pointer(json.loads(task['input']))
 
-        output = json.dumps(handler(event=payload))
+        with Heartbeat(sfn, token, interval=heartbeat):
+            output = handler(event=payload)
+            output = json.dumps(spill(output) if spill_outputs else output)
 
         sfn.send_task_success(taskToken=task['taskToken'], output=output)
+        return 'succeeded'
     except MemoryError as e:
         err = str(e)
         logger.error("Memory error when running task: %s" % err)
@@ -55,3 +229,4 @@ def get_and_run_task(handler, sfn, arn):
         tb = traceback.format_exc()
         err = (err[252] + ' ...') if len(err) > 252 else err
         sfn.send_task_failure(taskToken=task['taskToken'], error=str(err), cause=tb)
+        return 'failed'
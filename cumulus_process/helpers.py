@@ -1,66 +1,192 @@
+import io
 import os
+import re
 import gzip
-from dicttoxml import dicttoxml
-from xml.dom.minidom import parseString
-from cumulus_process.s3 import upload
+import shutil
+from functools import partial
+from cumulus_process.s3 import upload_many, copy_many, open_stream, uri_parser
 
+# size of the buffer used when decompressing files
+GUNZIP_BUFSIZE = 1024 * 1024
 
-def upload_files(files, bucket, prefix):
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" ?>'
+XML_PRETTY_DECLARATION = '<?xml version="1.0" ?>\n'
+XML_ESCAPES = [('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('"', '&quot;'), ("'", '&apos;')]
+XML_NAME = re.compile(r'^[^\W\d][\w.\-:]*$')
+
+
+def upload_files(files, bucket, prefix, workers=None, report=False, checksums=None):
     """uploads list of local files to a given bucket and prefix
 
     Arguments:
         files: list of file paths
         bucket: name of the bucket to upload the data to
         prefix: the prefix key the appears before the filename
+        workers: number of files uploaded at the same time (default pool.WORKERS)
+        report: return a report for each file instead of the uri
+        checksums: list of checksum algorithms computed while uploading (e.g. ['md5'])
+
+    Returns:
+        returns a list of s3 uris e.g. s3://example-bucket/my/prefix/filename.txt,
+        in the same order as files. If report is True, or checksums are given,
+        each item is instead a dictionary with the filename, uri, bytes, elapsed
+        seconds and checksums of the upload
+    """
+    uris = [os.path.join('s3://', bucket, prefix, os.path.basename(f)) for f in files]
+    results = upload_many(files, uris, workers=workers, checksums=checksums)
+    if report or checksums:
+        return results
+    return [r['uri'] for r in results]
+
+
+def copy_files(uris, bucket, prefix, workers=None):
+    """copies list of s3 objects to a given bucket and prefix, without downloading them
+
+    Arguments:
+        uris: list of s3 uris
+        bucket: name of the bucket to copy the data to
+        prefix: the prefix key the appears before the filename
+        workers: number of objects copied at the same time (default pool.WORKERS)
 
     Returns:
-        returns a list of s3 uris e.g. s3://example-bucket/my/prefix/filename.txt
+        returns a list of s3 uris e.g. s3://example-bucket/my/prefix/filename.txt,
+        in the same order as uris
     """
-    list_of_uris = []
-    for f in files:
-        s3_uri = os.path.join('s3://', bucket, prefix, os.path.basename(f))
-        list_of_uris.append(upload(f, s3_uri))
-    return list_of_uris
+    dsts = [os.path.join('s3://', bucket, prefix, uri_parser(u)['filename']) for u in uris]
+    return copy_many(uris, dsts, workers=workers)
 
 
 def dict_to_xml(meta, pretty=False, root='Granule'):
     """ Convert dictionary metadata to XML string """
-    # for lists, use the singular version of the parent XML name
-    singular_key_func = lambda x: x[:-1]
-    # convert to XML
+    buf = io.StringIO()
+    write_xml(meta, buf, pretty=pretty, root=root)
+    return buf.getvalue()
+
+
+def write_xml(meta, f, pretty=False, root='Granule', indent='\t'):
+    """ Write dictionary metadata as XML to a file object, one element at a time
+
+    Items of lists are named with the singular of the parent XML name (its
+    name without the last letter, or item if that is empty). The <Point> XML
+    tag does not follow the same rule as singular of parent since the parent
+    in CMR is <Boundary>, so metadata is created with a <Points> parent and
+    that tag is left out. Keys that are not valid XML names have spaces
+    replaced with underscores, digits prefixed with n, or are otherwise
+    written as <key name="..."> (as dicttoxml does)
+    """
+    write = f.write
+    newline = '\n' if pretty else ''
+    if not pretty:
+        indent = ''
+    # tag and end tag for each key
+    names = {}
+
+    def _text(value):
+        if value is True:
+            return 'true'
+        if value is False:
+            return 'false'
+        text = str(value)
+        for char, escape in XML_ESCAPES:
+            if char in text:
+                text = text.replace(char, escape)
+        return text
+
+    def _name(key):
+        name = names.get(key)
+        if name is None:
+            tag = str(key)
+            if not XML_NAME.match(tag):
+                if tag.isdigit():
+                    tag = 'n%s' % tag
+                elif XML_NAME.match(tag.replace(' ', '_')):
+                    tag = tag.replace(' ', '_')
+                else:
+                    tag = 'key name="%s"' % _text(tag)
+            name = names[key] = (tag, tag.split(' ', 1)[0])
+        return name
+
+    def _children(value, tag, level):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                _element(names.get(k) or _name(k), v, level)
+        else:
+            # items of <key name="..."> elements are <item>
+            item = (tag[0] == tag[1] and tag[1][:-1]) or 'item'
+            item = (item, item)
+            for v in value:
+                _element(item, v, level)
+
+    def _element(name, value, level):
+        tag, end = name
+        if tag == 'Points':
+            if isinstance(value, (dict, list, tuple, set)):
+                _children(value, name, level)
+            elif value is not None:
+                write(_text(value))
+            return
+        pad = indent * level
+        if isinstance(value, (dict, list, tuple, set)):
+            if not value:
+                write('%s<%s/>%s' % (pad, tag, newline) if pretty else '<%s></%s>' % (tag, end))
+                return
+            write('%s<%s>%s' % (pad, tag, newline))
+            _children(value, name, level + 1)
+            write('%s</%s>%s' % (pad, end, newline))
+        elif value is None or (isinstance(value, str) and not value):
+            write('%s<%s/>%s' % (pad, tag, newline) if pretty else '<%s></%s>' % (tag, end))
+        else:
+            write('%s<%s>%s</%s>%s' % (pad, tag, _text(value), end, newline))
+
     if root is None:
-        xml = str(dicttoxml(meta, root=False, attr_type=False, item_func=singular_key_func))
+        _children(meta, ('', ''), 0)
     else:
-        xml = str(dicttoxml(meta, custom_root=root, attr_type=False, item_func=singular_key_func))
-    # The <Point> XML tag does not follow the same rule as singular
-    # of parent since the parent in CMR is <Boundary>. Create metadata
-    # with the <Points> parent, and this removes that tag
-    xml = xml.replace('<Points>', '').replace('</Points>', '')
-    # pretty print
-    if pretty:
-        dom = parseString(xml)
-        xml = dom.toprettyxml()
-    return xml
+        write(XML_PRETTY_DECLARATION if pretty else XML_DECLARATION)
+        _element(_name(root), meta, 0)
 
 
 def write_metadata(meta, fout, pretty=False):
     """ Write metadata dictionary as XML file """
-    xml = dict_to_xml(meta, pretty=pretty)
     with open(fout, 'w') as f:
-        f.write(xml)
+        write_xml(meta, f, pretty=pretty)
+
 
+def gunzip(fname, remove=False, bufsize=GUNZIP_BUFSIZE, path=''):
+    """ Unzip a file, creating new file
 
-def gunzip(fname, remove=False):
-    """ Unzip a file, creating new file """
+    Data is decompressed bufsize bytes at a time. fname may also be an S3 uri,
+    which is decompressed as it streams from S3 into a new file in path
+    """
+    if fname[0:5] == 's3://':
+        f = os.path.join(path, os.path.splitext(uri_parser(fname)['filename'])[0])
+        body = open_stream(fname)
+        try:
+            with gzip.GzipFile(fileobj=body, mode='rb') as fin:
+                with open(f, 'wb') as fout:
+                    shutil.copyfileobj(fin, fout, bufsize)
+        finally:
+            body.close()
+        return f
     f = os.path.splitext(fname)[0]
     with gzip.open(fname, 'rb') as fin:
         with open(f, 'wb') as fout:
-            fout.write(fin.read())
+            shutil.copyfileobj(fin, fout, bufsize)
     if remove:
         os.remove(fname)
     return f
 
 
+def gunzip_many(fnames, remove=False, bufsize=GUNZIP_BUFSIZE, path='', workers=None):
+    """ Unzip files in parallel across processes (default one per cpu), returning new files in order """
+    fnames = list(fnames)
+    if workers == 1 or len(fnames) < 2:
+        return [gunzip(f, remove=remove, bufsize=bufsize, path=path) for f in fnames]
+    from concurrent.futures import ProcessPoolExecutor
+    func = partial(gunzip, remove=remove, bufsize=bufsize, path=path)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, fnames))
+
+
 def basename(filename):
     """ Strip path and extension """
     return os.path.splitext(os.path.basename(filename))[0]
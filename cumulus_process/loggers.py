@@ -1,33 +1,264 @@
-
+import os
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
 import datetime
-from pythonjsonlogger import jsonlogger
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# attributes of every record, other attributes (e.g. set with extra=) are copied into log messages
+RESERVED_ATTRS = frozenset(logging.LogRecord('', 0, '', 0, '', None, None).__dict__) | frozenset(
+    ('message', 'asctime', 'taskName', 'cumulus_context', 'suppressed'))
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        # e.g. keys orjson cannot serialize
+        return _json_dumps(obj)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, default=str)
+
+
+# use the fastest JSON encoder available
+dumps = _json_dumps if orjson is None else _orjson_dumps
+
+# default size of the queue of async loggers, and what to do when it is full
+QUEUE_SIZE = 10000
+OVERFLOW = 'drop'
+
+# seconds handlers wait for queued records to be written before returning
+FLUSH_TIMEOUT = 5
+
+# listeners of async loggers, by logger name
+_listeners = {}
+_listeners_lock = threading.Lock()
 
 
-class CumulusFormatter(jsonlogger.JsonFormatter):
-    """ Formatting for Cumulus logs """
+class CumulusFormatter(logging.Formatter):
+    """ Formatting for Cumulus logs, one JSON object per record
+
+    Messages are strings (formatted with any arguments) or dictionaries, and
+    are not modified. Context bound with a ContextAdapter, and record
+    attributes not in RESERVED_ATTRS (e.g. passed with extra=), are added to
+    every message
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CumulusFormatter, self).__init__(*args, **kwargs)
+        self._second = None
+        self._prefix = None
+
+    def timestamp(self, created):
+        """ ISO timestamp for a record creation time, formatting the date once per second """
+        second = int(created)
+        if second != self._second:
+            self._prefix = datetime.datetime.fromtimestamp(second).isoformat()
+            self._second = second
+        return '%s.%06d' % (self._prefix, (created - second) * 1e6)
 
     def format(self, record):
-        # if just a string, convert to JSON
-        if isinstance(record.msg, str):
-            record.msg = {'message': record.msg}
-        # create blank msg if not present
-        if 'message' not in record.msg.keys():
-            record.msg['message'] = ''
-        record.msg['timestamp'] = datetime.datetime.now().isoformat()
-        if hasattr(record, 'collectionName'):
-            record.msg['collectionName'] = record.collectionName
-        if hasattr(record, 'granuleId'):
-            record.msg['granuleId'] = record.granuleId
-        record.msg['level'] = record.levelname
-        res = super(CumulusFormatter, self).format(record)
-        return res
+        msg = record.msg
+        if isinstance(msg, dict):
+            out = {'message': ''}
+            out.update(msg)
+        else:
+            out = {'message': record.getMessage()}
+        out['timestamp'] = self.timestamp(record.created)
+        context = record.__dict__.get('cumulus_context')
+        if context:
+            out.update(context)
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS:
+                out[key] = value
+        out['level'] = record.levelname
+        suppressed = record.__dict__.get('suppressed')
+        if suppressed:
+            out['suppressed'] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out['exc_info'] = record.exc_text
+        return dumps(out)
+
+
+class ContextAdapter(logging.LoggerAdapter):
+    """ LoggerAdapter adding context bound once (e.g. collectionName) to every record """
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get('extra')
+        kwargs['extra'] = {'cumulus_context': self.extra}
+        if extra:
+            kwargs['extra'].update(extra)
+        return msg, kwargs
+
+
+class RateLimitFilter(logging.Filter):
+    """ Let through at most `rate` records a second for each message, at or below `level`
+
+    Records are grouped by logger and message before formatting (so messages
+    should pass their arguments separately, e.g. logger.debug('Uploading %s', uri)).
+    The number of records suppressed since the last one let through is added
+    to it as `suppressed`
+    """
+
+    def __init__(self, rate, level=logging.DEBUG):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.level = level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else None)
+        second = int(record.created)
+        with self._lock:
+            if len(self._windows) > 10000:
+                # forget messages not seen for a second or more
+                self._windows = {k: w for k, w in self._windows.items() if w[0] >= second - 1}
+            window = self._windows.get(key)
+            if window is None or window[0] != second:
+                suppressed = 0 if window is None else window[2]
+                window = self._windows[key] = [second, 0, suppressed]
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed = window[2]
+                window[2] = 0
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """ QueueHandler for a bounded queue, dropping records (overflow='drop') or waiting (overflow='block') when full
+
+    Records are formatted by the listener thread, only the message arguments
+    and any traceback are resolved when queued. The number of dropped records
+    is in `dropped`, and reported with the next record queued
+    """
+
+    def __init__(self, q, overflow=OVERFLOW):
+        if overflow not in ('drop', 'block'):
+            raise ValueError('Invalid overflow policy %s' % overflow)
+        super(BoundedQueueHandler, self).__init__(q)
+        self.overflow = overflow
+        self.dropped = 0
+        self._reported = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        else:
+            record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped > self._reported:
+                # counts may be off by a few records when logging from several threads
+                dropped = self.dropped - self._reported
+                self._reported = self.dropped
+                warning = logging.LogRecord(record.name, logging.WARNING, record.pathname, record.lineno,
+                                            '%s log records dropped, log queue full' % dropped, None, None)
+                self.queue.put_nowait(warning)
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    """ QueueListener that can always be stopped, even with a full queue, and restarted after a fork """
+
+    def __init__(self, queue_handler, *handlers, **kwargs):
+        super(_Listener, self).__init__(queue_handler.queue, *handlers, **kwargs)
+        self.queue_handler = queue_handler
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def restart(self):
+        """ Start a new thread with an empty queue, records queued by the parent are written by the parent """
+        self.queue = self.queue_handler.queue = queue.Queue(self.queue.maxsize)
+        self._thread = None
+        self.start()
+
+
+def flush(timeout=None):
+    """ Wait until records queued by async loggers have been written, up to timeout seconds """
+    with _listeners_lock:
+        listeners = list(_listeners.values())
+    deadline = None if timeout is None else time.time() + timeout
+    for listener in listeners:
+        while listener.queue.unfinished_tasks and listener._thread is not None and listener._thread.is_alive():
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.001)
+    return True
+
+
+def shutdown():
+    """ Write all queued records and stop the async logger threads """
+    with _listeners_lock:
+        listeners = list(_listeners.values())
+        _listeners.clear()
+    for listener in listeners:
+        listener.stop()
+
+
+def _after_fork():
+    """ Restart async logger threads in a forked child, which only has the thread that forked """
+    global _listeners_lock
+    _listeners_lock = threading.Lock()
+    for listener in _listeners.values():
+        listener.restart()
+
+
+atexit.register(shutdown)
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _stop_listener(name):
+    with _listeners_lock:
+        listener = _listeners.pop(name, None)
+    if listener is not None:
+        listener.stop()
 
 
 def getLogger(name, stdout=None):
-    """ Return logger suitable for Cumulus """
+    """ Return logger suitable for Cumulus
+
+    stdout configures a handler writing JSON records to stderr:
+        level: records below this level are not written
+        async: if True, records are written by a background thread through a queue
+        queue_size: size of the queue (default QUEUE_SIZE)
+        overflow: 'drop' new records (default) or 'block' until there is space when the queue is full
+        rate_limit: most DEBUG records written a second for the same message
+    """
     logger = logging.getLogger(name)
     # clear existing handlers
+    _stop_listener(name)
     logger.handlers = []
     if (stdout is None):
         logger.addHandler(logging.NullHandler())
@@ -35,6 +266,17 @@ def getLogger(name, stdout=None):
         handler = logging.StreamHandler()
         handler.setLevel(stdout['level'])
         handler.setFormatter(CumulusFormatter())
+        if stdout.get('async', False):
+            q = queue.Queue(stdout.get('queue_size', QUEUE_SIZE))
+            queue_handler = BoundedQueueHandler(q, overflow=stdout.get('overflow', OVERFLOW))
+            queue_handler.setLevel(stdout['level'])
+            listener = _Listener(queue_handler, handler, respect_handler_level=True)
+            listener.start()
+            with _listeners_lock:
+                _listeners[name] = listener
+            handler = queue_handler
+        if stdout.get('rate_limit'):
+            handler.addFilter(RateLimitFilter(stdout['rate_limit']))
         logger.addHandler(handler)
     # logging level
     logger.setLevel(1)
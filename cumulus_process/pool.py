@@ -0,0 +1,31 @@
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+# default number of workers used by bulk operations
+WORKERS = int(os.getenv('CUMULUS_WORKERS', 8))
+
+
+def run_all(func, items, workers=None):
+    """ Call func on every item using a bounded thread pool
+
+    Results are returned in the same order as items. If any call raises,
+    calls that have not started yet are cancelled and the exception is re-raised.
+    Each call runs in a copy of the caller's context (see contextvars).
+    """
+    items = list(items)
+    if workers is None:
+        workers = WORKERS
+    workers = max(1, min(workers, len(items)))
+    if workers == 1:
+        return [func(item) for item in items]
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for f in futures:
+            if f in done and f.exception() is not None:
+                raise f.exception()
+        return [f.result() for f in futures]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
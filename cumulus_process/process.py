@@ -1,19 +1,21 @@
 
 import os
 import re
-import gzip
-import subprocess
-import logging
+import sys
+import json
+import time
 import warnings
+import traceback
 from shutil import rmtree
 from tempfile import mkdtemp
-from dicttoxml import dicttoxml
-from xml.dom.minidom import parseString
-from cumulus_process.s3 import download, upload
-from cumulus_process.loggers import getLogger
-from cumulus_process.cli import cli
-from cumulus_process.handlers import activity
-from run_cumulus_task import run_cumulus_task
+from cumulus_process import helpers
+from cumulus_process.s3 import download, download_json, upload, resolve_pointer
+from cumulus_process.loggers import getLogger, ContextAdapter, flush as flush_logs, FLUSH_TIMEOUT
+from cumulus_process.handlers import activity, heartbeat, spill, HEARTBEAT_INTERVAL
+from cumulus_process.pool import run_all
+from cumulus_process.rules import InputIndex, get_publish_rules
+from cumulus_process.checksums import hash_file
+from cumulus_process import stats, warm, commands
 
 logger = getLogger(__name__)
 
@@ -90,30 +92,105 @@ class Process(object):
 
         # save downloaded files so we can clean up later
         self.downloads = []
+        # checksums of local input files, by filename and algorithm
+        self.checksums = {}
+        # inputs by input key, built on first use
+        self._index = None
+        self._publish_rules = None
 
         # output granules
         self.output = []
 
-        # set up logger
-        self.logger = logging.LoggerAdapter(logger, {})
+        # set up logger, with context added to every message
+        context = {}
+        collection = config.get('collection', {})
+        if isinstance(collection, dict) and 'name' in collection:
+            context['collectionName'] = collection['name']
+        if 'granuleId' in kwargs:
+            context['granuleId'] = kwargs['granuleId']
+        self.logger = ContextAdapter(logger, context)
 
-    def fetch(self, key, remote=False):
-        """ Get local (default) or remote input filename """
-        regex = self.input_keys.get(key, None)
+        # timing spans and transfer metrics, recorded when CUMULUS_STATS is set
+        self.stats = stats.Stats() if stats.enabled() else stats.NULL
+
+    @property
+    def index(self):
+        """ Index of input files by input key, rebuilt if input or input_keys change """
+        input_keys = self.input_keys
+        if self._index is None or not self._index.is_current(input_keys, self.input):
+            local = None if self._index is None else self._index.local
+            self._index = InputIndex(input_keys, self.input, local=local)
+        return self._index
+
+    def fetch(self, key, remote=False, concurrency=1, checksums=None):
+        """ Get local (default) or remote input filename
+
+        Up to `concurrency` files are downloaded at the same time, the returned
+        filenames keep the order of self.input. Files already downloaded are reused.
+        With remote='stream', seekable read-only file objects are returned instead,
+        reading remote files with ranged requests rather than downloading them.
+        Checksums for a list of algorithms (e.g. ['md5']) of local files are saved
+        in self.checksums, computed while downloading. When the download cache
+        hard links files (CUMULUS_CACHE_HARDLINK), local files must not be
+        modified in place
+        """
+        index = self.index
+        regex = index.input_keys.get(key, None)
         if regex is None:
             raise Exception('No files matching %s' % regex)
-        outfiles = []
-        for f in self.input:
-            m = re.match(regex, os.path.basename(f))
-            if m is not None:
-                # if remote desired, or input is already local
-                if remote or os.path.exists(f):
-                    outfiles.append(f)
-                else:
-                    fname = download(f, path=self.path)
-                    outfiles.append(fname)
-                    self.downloads.append(fname)
-        return outfiles
+        matches = index.get(key)
+        if remote == 'stream':
+            return [self._open(index.local.get(f, f)) for f in matches]
+        # if remote desired, or input is already local
+        if remote:
+            return matches
+        with self.stats.span('fetch'):
+            self._download([f for f in matches if not os.path.exists(f)], concurrency, checksums)
+            fnames = [index.local.get(f, f) for f in matches]
+            self._checksum(fnames, checksums)
+        return fnames
+
+    def prefetch(self, keys=None, concurrency=None, checksums=None):
+        """ Download all files matching any of keys (default all input_keys) in parallel """
+        index = self.index
+        if keys is None:
+            keys = list(index.files)
+        matches = {key: self.fetch(key, remote=True) for key in keys}
+        uris = [f for files in matches.values() for f in files if not os.path.exists(f)]
+        with self.stats.span('fetch'):
+            self._download(uris, concurrency, checksums)
+            fnames = {key: [index.local.get(f, f) for f in files] for key, files in matches.items()}
+            self._checksum([f for files in fnames.values() for f in files], checksums)
+        return fnames
+
+    def _open(self, fname):
+        """ Open a local file, or stream a remote file """
+        if os.path.exists(fname):
+            return open(fname, 'rb')
+        from cumulus_process.stream import S3File
+        return S3File(fname)
+
+    def _download(self, uris, concurrency=None, checksums=None):
+        """ Download remote inputs not already downloaded, failing on the first error """
+        local = self.index.local
+        uris = [u for u in dict.fromkeys(uris) if not os.path.exists(local.get(u, ''))]
+        results = run_all(lambda uri: download(uri, path=self.path, checksums=checksums), uris, workers=concurrency)
+        fnames = []
+        for uri, result in zip(uris, results):
+            fname = result
+            if checksums:
+                fname, self.checksums[fname] = result
+            local[uri] = fname
+            self.downloads.append(fname)
+            fnames.append(fname)
+        return fnames
+
+    def _checksum(self, fnames, checksums):
+        """ Compute checksums not computed while downloading """
+        for fname in fnames:
+            missing = [a for a in checksums or [] if a not in self.checksums.get(fname, {})]
+            if missing and os.path.exists(fname):
+                self.checksums.setdefault(fname, {}).update(hash_file(fname, missing))
 
     def fetch_all(self, remote=False):
         """ Download all files in remote_in """
@@ -130,13 +207,7 @@ class Process(object):
             'use upload functions in s3 module instead',
             DeprecationWarning
         )
-        info = self.get_publish_info(filename)
-        if info is None:
-            return filename
-        try:
-            return upload(filename, info['s3'], extra={}) if info.get('s3', False) else None
-        except Exception as e:
-            self.logger.error("Error uploading file %s: %s" % (os.path.basename(os.path.basename(filename)), str(e)))
+        return self._publish(filename, self.publish_rules.resolve(filename))
 
     def upload_output_files(self):
         """ Uploads all self.outputs """
@@ -145,7 +216,24 @@ class Process(object):
             'use helper functions from the helper module instead',
             DeprecationWarning
         )
-        return [self.upload_file(f) for f in self.output]
+        infos = self.publish_rules.resolve_many(self.output)
+        return [self._publish(f, info) for f, info in zip(self.output, infos)]
+
+    def _publish(self, filename, info):
+        """ Upload a local file to the s3 location in its publishing info """
+        if info is None:
+            return filename
+        try:
+            if not info.get('s3', False):
+                return None
+            with self.stats.span('upload'):
+                return upload(filename, info['s3'], extra={})
+        except Exception as e:
+            self.logger.error("Error uploading file %s: %s" % (os.path.basename(os.path.basename(filename)), str(e)))
+
+    def heartbeat(self, message=None):
+        """ Report progress, sending a heartbeat if running as an activity task """
+        return heartbeat(message)
 
     def clean_downloads(self):
         """ Remove input files """
@@ -170,7 +258,11 @@ class Process(object):
 
     def clean_all(self):
         """ Removes anything saved to self.path """
-        rmtree(self.path)
+        if warm.is_scratch(self.path):
+            # the scratch directory is reused by the next invocation
+            warm.empty(self.path)
+        else:
+            rmtree(self.path)
 
     # ## Publishing functions
     # properties to access payload parameters for publishing
@@ -199,33 +291,20 @@ class Process(object):
         )
         return self.config.get('distribution_endpoint', 'https://cumulus.com')
 
+    @property
+    def publish_rules(self):
+        """ Publishing rules compiled from config, built on first use """
+        if self._publish_rules is None:
+            self._publish_rules = get_publish_rules(self.config)
+        return self._publish_rules
+
     def get_publish_info(self, filename):
         """ Get publishing info for this file from the collection metadata """
         warnings.warn(
             'get_publish_info method is deprecated and will be removed in the next release',
             DeprecationWarning
         )
-        files = self.config.get('files_config', [])
-        info = None
-        count = 0
-        for f in files:
-            m = re.match(f['regex'], os.path.basename(filename))
-            if m is not None:
-                count += 1
-                info = f
-                file_bucket = f.get('bucket', 'public')
-                bucket = self.buckets.get(file_bucket, None)
-                if bucket is not None:
-                    prefix = f.get('fileStagingDir', self.config.get('fileStagingDir', ''))
-                    if prefix is None:
-                        prefix = f.get('url_path', self.config.get('url_path', ''))
-                    s3_url = os.path.join('s3://', bucket['name'], prefix, os.path.basename(filename))
-                    http_url = 'http://%s.s3.amazonaws.com' % bucket['name'] if bucket['type'] == 'public' else self.default_url
-                    http_url = os.path.join(http_url, prefix, os.path.basename(filename))
-                    info.update({'s3': s3_url, 'http': http_url})
-        if (count) > 1:
-            raise Exception('More than one regex matches %s' % filename)
-        return info
+        return self.publish_rules.resolve(filename)
 
     # ## Utility functions
 
@@ -237,22 +316,7 @@ class Process(object):
             'use helper functions from the helper module instead',
             DeprecationWarning
         )
-        # for lists, use the singular version of the parent XML name
-        singular_key_func = lambda x: x[:-1]
-        # convert to XML
-        if root is None:
-            xml = str(dicttoxml(meta, root=False, attr_type=False, item_func=singular_key_func))
-        else:
-            xml = str(dicttoxml(meta, custom_root=root, attr_type=False, item_func=singular_key_func))
-        # The <Point> XML tag does not follow the same rule as singular
-        # of parent since the parent in CMR is <Boundary>. Create metadata
-        # with the <Points> parent, and this removes that tag
-        xml = xml.replace('<Points>', '').replace('</Points>', '')
-        # pretty print
-        if pretty:
-            dom = parseString(xml)
-            xml = dom.toprettyxml()
-        return xml
+        return helpers.dict_to_xml(meta, pretty=pretty, root=root)
 
     @classmethod
     def write_metadata(cls, meta, fout, pretty=False):
@@ -262,20 +326,37 @@ class Process(object):
             'use helper functions from the helper module instead',
             DeprecationWarning
         )
-        xml = cls.dicttoxml(meta, pretty=pretty)
-        with open(fout, 'w') as f:
-            f.write(xml)
+        helpers.write_metadata(meta, fout, pretty=pretty)
+
+    def run_command(self, cmd, timeout=None):
+        """ Run cmd as a system command (an argv list, or a string split like a shell would)
 
-    def run_command(self, cmd):
-        """ Run cmd as a system command """
+        Output is logged as it is written, and the last commands.TAIL_LINES
+        lines are returned. The command is killed after timeout seconds.
+        """
         try:
-            self.logger.debug(cmd)
-            out = subprocess.check_output(cmd.split(' '), stderr=subprocess.STDOUT)
-            self.logger.debug(out)
-            return out
+            result = commands.run_command(cmd, timeout=timeout, log=self.logger)
+        except commands.CommandError as e:
+            self._command_stats(e.result)
+            raise
         except Exception as e:
             self.logger.debug(str(e))
             raise RuntimeError('Error running %s' % cmd)
+        self._command_stats(result)
+        return result['output']
+
+    def run_commands(self, cmds, concurrency=None, timeout=None):
+        """ Run independent system commands in parallel, `concurrency` at a time (default one per cpu)
+
+        Returns the output of each command in order, see run_command
+        """
+        return run_all(lambda cmd: self.run_command(cmd, timeout=timeout), cmds,
+                       workers=concurrency or os.cpu_count())
+
+    def _command_stats(self, result):
+        """ Record time and resource usage of a command """
+        self.stats.add_span('command', result['elapsed'], command=result['command'], returncode=result['returncode'],
+                            cpu_time=result['cpu_time'], max_rss=result['max_rss'])
 
     @classmethod
     def gunzip(cls, fname, remove=False):
@@ -285,13 +366,7 @@ class Process(object):
             'use helper functions from the helper module instead',
             DeprecationWarning
         )
-        f = os.path.splitext(fname)[0]
-        with gzip.open(fname, 'rb') as fin:
-            with open(f, 'wb') as fout:
-                fout.write(fin.read())
-        if remove:
-            os.remove(fname)
-        return f
+        return helpers.gunzip(fname, remove=remove)
 
     @classmethod
     def basename(cls, filename):
@@ -306,39 +381,194 @@ class Process(object):
     # ## Handlers
     @classmethod
     def handler(cls, event, context=None, path=None, noclean=False):
-        """ General event handler """
-        return cls.run(path=path, noclean=noclean, **event)
+        """ General event handler, outputs over SFN_PAYLOAD_LIMIT are written to S3 (see handlers.spill) """
+        try:
+            return spill(cls._handler(event, context, path=path, noclean=noclean))
+        finally:
+            # write queued log records before Lambda freezes the process
+            flush_logs(FLUSH_TIMEOUT)
+
+    @classmethod
+    def _handler(cls, event, context=None, path=None, noclean=False):
+        """ Run an event, returning the output as is
+
+        Unless a path is given, files are saved in a scratch directory that is
+        reused (emptied) by later invocations in the same container
+        """
+        start = warm.invocation()
+        logger.info({'message': 'Starting %s invocation' % ('cold' if start['cold'] else 'warm'), **start})
+        if path is None:
+            path = warm.scratch_dir()
+        return cls.run(path=path, noclean=noclean, **resolve_pointer(event))
 
     @classmethod
     def cumulus_handler(cls, event, context=None):
-        """ General event handler using Cumulus messaging (cumulus-message-adapter) """
-        return run_cumulus_task(cls.handler, event, context)
+        """ General event handler using Cumulus messaging (cumulus-message-adapter)
+
+        Outputs are not spilled to S3, the message adapter handles large messages
+        """
+        from run_cumulus_task import run_cumulus_task
+        try:
+            return run_cumulus_task(cls._handler, event, context)
+        finally:
+            flush_logs(FLUSH_TIMEOUT)
 
     @classmethod
     def cli(cls):
+        from cumulus_process.cli import cli
         cli(cls)
 
     @classmethod
-    def activity(cls, arn=os.getenv('ACTIVITY_ARN')):
-        """ Run an AWS activity for a step function """
-        activity(cls.handler, arn)
+    def activity(cls, arn=os.getenv('ACTIVITY_ARN'), workers=1, mode='thread', heartbeat=HEARTBEAT_INTERVAL):
+        """ Run an AWS activity for a step function, with `workers` threads or processes (mode) """
+        # outputs are spilled by the activity worker
+        return activity(cls._handler, arn, workers=workers, mode=mode, heartbeat=heartbeat)
 
     @classmethod
-    def cumulus_activity(cls, arn=os.getenv('ACTIVITY_ARN')):
+    def cumulus_activity(cls, arn=os.getenv('ACTIVITY_ARN'), workers=1, mode='thread', heartbeat=HEARTBEAT_INTERVAL):
         """ Run an activity using Cumulus messaging (cumulus-message-adapter) """
-        activity(cls.cumulus_handler, arn)
+        # outputs are Cumulus messages, large messages are left to the message adapter
+        return activity(cls.cumulus_handler, arn, workers=workers, mode=mode, heartbeat=heartbeat,
+                        spill_outputs=False)
 
     @classmethod
     def run(cls, *args, **kwargs):
         """ Run this payload with the given Process class """
         noclean = kwargs.pop('noclean', False)
         process = cls(*args, **kwargs)
+        with process.stats.activate():
+            try:
+                with process.stats.span('process'):
+                    output = process.process()
+            finally:
+                if not noclean:
+                    with process.stats.span('clean'):
+                        process.clean_all()
+                process.log_stats()
+        return output
+
+    def log_stats(self):
+        """ Log a summary of the run's stats as a CloudWatch Embedded Metric Format record """
+        if self.stats.enabled:
+            summary = self.stats.emf(dimensions={'Process': self.__class__.__name__})
+            summary['message'] = 'Run stats'
+            self.logger.info(summary)
+
+    @classmethod
+    def iter_many(cls, payloads, workers=None, path=None, noclean=False):
+        """ Run many payloads (dictionaries, or S3 uris of JSON messages) on a pool of `workers` processes
+
+        Yields a result for each payload as it completes: its index, status
+        (succeeded or failed), elapsed seconds, and output or error. Payloads are
+        read from the iterable as workers become free. If a worker dies (e.g.
+        killed when out of memory), payloads in flight are failed and the rest
+        run on new workers. Each payload is run in its own new directory under
+        path (default a temporary directory) or, unless noclean is set, in the
+        worker's scratch directory, which is emptied for the next payload.
+        workers defaults to one per cpu
+        """
+        payloads = enumerate(payloads)
+        workers = workers or os.cpu_count()
+        if workers == 1:
+            for index, payload in payloads:
+                yield _run_one(cls, index, payload, path, noclean)
+            return
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        from concurrent.futures.process import BrokenProcessPool
+        # payloads submitted ahead of free workers
+        limit = 2 * workers
+        pending = {}
+
+        def _completed(futures):
+            results = []
+            for future in futures:
+                index, payload = pending.pop(future)
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # the worker died (e.g. killed when out of memory), or the payload could not be sent to it
+                    results.append(_failed(index, payload, e))
+            return results
+
+        executor = ProcessPoolExecutor(max_workers=workers)
         try:
-            output = process.process()
+            for index, payload in payloads:
+                if len(pending) >= limit:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from _completed(done)
+                try:
+                    future = executor.submit(_run_one, cls, index, payload, path, noclean)
+                except BrokenProcessPool:
+                    # payloads in flight failed with the pool, run the rest on a new one
+                    done, _ = wait(pending)
+                    yield from _completed(done)
+                    executor.shutdown()
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                    future = executor.submit(_run_one, cls, index, payload, path, noclean)
+                pending[future] = (index, payload)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _completed(done)
         finally:
-            if not noclean:
-                process.clean_all()
-        return output
+            executor.shutdown(cancel_futures=True)
+
+    @classmethod
+    def run_many(cls, payloads, workers=None, output=None, path=None, noclean=False):
+        """ Run many payloads in parallel processes (see iter_many), writing results as JSON lines to output
+
+        output is a filename, '-' for stdout, or None. Returns the number of
+        payloads that succeeded and failed, elapsed seconds and throughput
+        (payloads per second)
+        """
+        start = time.time()
+        summary = {'total': 0, 'succeeded': 0, 'failed': 0}
+        if output == '-':
+            f = sys.stdout
+        else:
+            f = open(output, 'w') if output is not None else None
+        try:
+            for result in cls.iter_many(payloads, workers=workers, path=path, noclean=noclean):
+                summary['total'] += 1
+                summary[result['status']] += 1
+                if result['status'] == 'failed':
+                    logger.error('Payload %s failed: %s' % (result['index'], result['error']))
+                if f is not None:
+                    f.write(json.dumps(result, default=str) + '\n')
+                    f.flush()
+        finally:
+            if f is not None and f is not sys.stdout:
+                f.close()
+        summary['elapsed'] = time.time() - start
+        summary['throughput'] = summary['total'] / summary['elapsed'] if summary['elapsed'] else 0
+        logger.info(dict(summary, message='Ran %s payloads' % summary['total']))
+        return summary
+
+
+def _run_one(cls, index, payload, path, noclean):
+    """ Run a payload of a batch, returning its result instead of raising """
+    start = time.time()
+    result = {'index': index}
+    if isinstance(payload, str):
+        result['payload'] = payload
+    try:
+        event = resolve_pointer(download_json(payload) if isinstance(payload, str) else payload)
+        # files kept with noclean would be removed by the next payload in the scratch directory
+        run_path = mkdtemp(dir=path) if path or noclean else warm.scratch_dir()
+        result['output'] = cls.run(path=run_path, noclean=noclean, **event)
+        result['status'] = 'succeeded'
+    except Exception as e:
+        result.update(status='failed', error=str(e), traceback=traceback.format_exc())
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def _failed(index, payload, error):
+    """ Result of a payload of a batch that could not be run by a worker """
+    result = {'index': index, 'status': 'failed', 'error': '%s: %s' % (type(error).__name__, error),
+              'traceback': ''.join(traceback.format_exception(error)), 'elapsed': None}
+    if isinstance(payload, str):
+        result['payload'] = payload
+    return result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+# patterns with back references or conditional group references can't be renumbered into a combined regex
+BACKREF = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+# config used by PublishRules, hashed to key compiled rules
+PUBLISH_KEYS = ('buckets', 'distribution_endpoint', 'files_config', 'fileStagingDir', 'url_path')
+
+# compiled matchers and publishing rules, reused by every Process in this interpreter
+MAX_CACHED = 64
+_matchers = {}
+_publish_rules = {}
+_cache_lock = threading.Lock()
+
+
+class Matcher(object):
+    """ Match names against a list of regexes, all tested in a single pass """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.compiled = [re.compile(p) for p in self.patterns]
+        self.combined = None
+        if not any(BACKREF.search(p) for p in self.patterns):
+            # an optional lookahead per pattern, each capturing when its pattern matches
+            try:
+                self.combined = re.compile(''.join('(?=(?P<_%d>%s))?' % (i, p) for i, p in enumerate(self.patterns)))
+            except re.error:
+                pass
+
+    def match(self, name):
+        """ Return indices of all patterns matching the start of name """
+        if self.combined is None:
+            return [i for i, r in enumerate(self.compiled) if r.match(name) is not None]
+        m = self.combined.match(name)
+        return [i for i in range(len(self.patterns)) if m.group('_%d' % i) is not None]
+
+
+class InputIndex(object):
+    """ Input files grouped by input key, built once with a single pass over the inputs """
+
+    def __init__(self, input_keys, inputs, local=None):
+        # non-string values in input_keys are settings, not patterns
+        self.input_keys = dict(input_keys)
+        self.inputs = list(inputs)
+        keys = [k for k, v in self.input_keys.items() if isinstance(v, str)]
+        matcher = get_matcher([self.input_keys[k] for k in keys])
+        self.files = {k: [] for k in keys}
+        # duplicate inputs are only indexed once
+        for f in dict.fromkeys(self.inputs):
+            for i in matcher.match(os.path.basename(f)):
+                self.files[keys[i]].append(f)
+        # local filenames of downloaded inputs, by remote uri
+        self.local = {} if local is None else local
+
+    def is_current(self, input_keys, inputs):
+        """ Check if index was built from these input_keys and inputs """
+        return self.inputs == list(inputs) and self.input_keys == input_keys
+
+    def get(self, key):
+        """ Get input files matching key """
+        return self.files.get(key, [])
+
+
+class PublishRules(object):
+    """ Publishing rules from files_config, compiled once from a Process config """
+
+    def __init__(self, config):
+        buckets = config.get('buckets', {})
+        default_url = config.get('distribution_endpoint', 'https://cumulus.com')
+        self.rules = []
+        for f in config.get('files_config', []):
+            rule = {'info': dict(f)}
+            bucket = buckets.get(f.get('bucket', 'public'), None)
+            if bucket is not None:
+                prefix = f.get('fileStagingDir', config.get('fileStagingDir', ''))
+                if prefix is None:
+                    prefix = f.get('url_path', config.get('url_path', ''))
+                http_url = 'http://%s.s3.amazonaws.com' % bucket['name'] if bucket['type'] == 'public' else default_url
+                rule['s3'] = os.path.join('s3://', bucket['name'], prefix)
+                rule['http'] = os.path.join(http_url, prefix)
+            self.rules.append(rule)
+        self.matcher = get_matcher([f['regex'] for f in config.get('files_config', [])])
+
+    def resolve(self, filename):
+        """ Get publishing info for this file, or None if no rule matches """
+        basename = os.path.basename(filename)
+        matches = self.matcher.match(basename)
+        if len(matches) > 1:
+            raise Exception('More than one regex matches %s' % filename)
+        if not matches:
+            return None
+        rule = self.rules[matches[0]]
+        info = dict(rule['info'])
+        if 's3' in rule:
+            info.update({'s3': os.path.join(rule['s3'], basename), 'http': os.path.join(rule['http'], basename)})
+        return info
+
+    def resolve_many(self, filenames):
+        """ Get publishing info for each of filenames """
+        return [self.resolve(f) for f in filenames]
+
+
+def _cached(cache, key, build):
+    """ Get key from a bounded cache, building it on a miss """
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        with _cache_lock:
+            if len(cache) >= MAX_CACHED:
+                cache.clear()
+            cache[key] = value
+    return value
+
+
+def get_matcher(patterns):
+    """ Matcher for patterns, compiled once and reused """
+    patterns = tuple(patterns)
+    return _cached(_matchers, patterns, lambda: Matcher(patterns))
+
+
+def config_hash(config, keys=PUBLISH_KEYS):
+    """ Hash of the parts of a config used to build rules """
+    subset = {k: config[k] for k in keys if k in config}
+    return hashlib.sha1(json.dumps(subset, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_publish_rules(config):
+    """ PublishRules for config, compiled once per config hash and reused """
+    return _cached(_publish_rules, config_hash(config), lambda: PublishRules(config))
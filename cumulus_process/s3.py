@@ -1,28 +1,139 @@
 #!/usr/bin/env python
 
 import os
+import gzip
 import json
 import logging
-import boto3
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cumulus_process.pool import run_all, WORKERS
+from cumulus_process.cache import get_cache
+from cumulus_process import stats
+from cumulus_process.checksums import HashingFile, hash_file, from_s3, S3_ALGORITHMS
 
 logger = logging.getLogger(__name__)
 
 REQUESTER_PAYS = { 'RequestPayer': 'requester' }
-def get_client(client='s3'):
-    """ creates and return a boto3 (aws) client """
 
+# size of the connection pool for each cached client, shared by every thread using it
+MAX_POOL_CONNECTIONS = int(os.getenv('CUMULUS_MAX_POOL_CONNECTIONS', 50))
+
+MB = 1024 ** 2
+
+# transfer settings by object size: (max object size, multipart chunk size, concurrent parts per object)
+TRANSFER_TIERS = [
+    (8 * MB, 8 * MB, 1),
+    (512 * MB, 16 * MB, 4),
+    (8 * 1024 * MB, 64 * MB, 8),
+]
+
+# S3 limit on the number of parts in a multipart upload
+MAX_PARTS = 10000
+
+# shared TransferConfigs, by chunk size and concurrency
+_transfer_configs = {}
+
+# key of a small message pointing to a JSON payload stored on S3
+POINTER_KEY = 's3_payload'
+
+# magic numbers of compressed JSON payloads
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# objects larger than this are copied in parts (the copy_object limit is 5 GiB)
+MAX_COPY_SIZE = 5 * 1024 * MB
+COPY_PART_SIZE = 512 * MB
+
+# maximum number of keys in a single delete_objects request
+MAX_DELETE_KEYS = 1000
+
+# seconds head_many results are reused for
+HEAD_CACHE_TTL = 5
+
+# recent head_many results, by uri
+_heads = {}
+_heads_lock = threading.Lock()
+
+# process-wide cache of clients, keyed by service, region, endpoint and config
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def clear_clients():
+    """ Drop all cached clients (called automatically in a forked child) """
+    global _clients_lock
+    _clients.clear()
+    # the lock may have been held by another thread at the time of the fork
+    _clients_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=clear_clients)
+
+
+def _config_key(config):
+    """ Hashable representation of a botocore Config """
+    if config is None:
+        return None
+    return tuple(sorted((k, repr(v)) for k, v in config._user_provided_options.items()))
+
+
+def get_client(client='s3', region=None, config=None, max_pool_connections=None):
+    """ Return a cached boto3 (aws) client, creating it on first use
+
+    Clients are shared across threads and keyed by service, region, endpoint
+    and botocore Config, so credentials and connection pools are reused
+    between calls. The cache is emptied in forked child processes.
+    """
+    # boto3 is imported on first use, it is most of the import time of this package
+    import boto3
+    from botocore.client import Config
+    if max_pool_connections is None:
+        max_pool_connections = MAX_POOL_CONNECTIONS
+    pool_config = Config(max_pool_connections=max_pool_connections)
+    config = pool_config if config is None else pool_config.merge(config)
+
+    kwargs = {}
     localstack = os.getenv('LOCALSTACK_HOST')
     if localstack:
-        return boto3.client(
-            client,
-            region_name='us-east-1',
-            endpoint_url='http://%s:%s' % (localstack, 4566),
-            use_ssl=False,
-            aws_access_key_id='fake-key',
-            aws_secret_access_key='fake-secret',
-        )
+        kwargs = {
+            'endpoint_url': 'http://%s:%s' % (localstack, 4566),
+            'use_ssl': False,
+            'aws_access_key_id': 'fake-key',
+            'aws_secret_access_key': 'fake-secret',
+        }
+        region = region or 'us-east-1'
+
+    key = (client, region, kwargs.get('endpoint_url'), _config_key(config))
+    cached = _clients.get(key)
+    if cached is not None:
+        return cached
+    with _clients_lock:
+        if key not in _clients:
+            # boto3's default session is not thread-safe, use one per client
+            session = boto3.session.Session()
+            _clients[key] = session.client(client, region_name=region, config=config, **kwargs)
+            _clients[key].meta.events.register('after-call', stats._count_retries)
+        return _clients[key]
+
 
-    return boto3.client(client)
+def transfer_config(size):
+    """ Return a shared TransferConfig with chunk size and concurrency suited to an object of size bytes """
+    from boto3.s3.transfer import TransferConfig
+    for max_size, chunksize, concurrency in TRANSFER_TIERS:
+        if size <= max_size:
+            break
+    # keep large objects within the part limit
+    chunksize = max(chunksize, -(-size // MAX_PARTS))
+    key = (chunksize, concurrency)
+    if key not in _transfer_configs:
+        _transfer_configs[key] = TransferConfig(
+            multipart_threshold=chunksize, multipart_chunksize=chunksize,
+            max_concurrency=concurrency, use_threads=concurrency > 1
+        )
+    return _transfer_configs[key]
 
 
 def uri_parser(uri):
@@ -45,73 +156,363 @@ def mkdirp(path):
     return path
 
 
-def download(uri, path='', extra=None):
-    """ Download object from S3 """
+def download(uri, path='', extra=None, client=None, cache=None, checksums=None):
+    """ Download object from S3
+
+    If a DownloadCache is given (or set up with CUMULUS_CACHE_DIR), the object
+    is looked up in the cache by its ETag or version id before downloading.
+    If a list of checksum algorithms is given (e.g. ['md5', 'sha256']), they are
+    computed as the data is written, or taken from S3 when it stores them, and
+    (filename, {algorithm: hexdigest}) is returned
+    """
     if extra is None:
         extra = REQUESTER_PAYS
     s3_uri = uri_parser(uri)
     fout = os.path.join(path, s3_uri['filename'])
-    logger.debug('Downloading %s as %s' % (uri, fout))
+    logger.debug('Downloading %s as %s', uri, fout)
     if path != '':
         mkdirp(path)
 
-    s3 = get_client()
+    s3 = client or get_client()
+
+    hashes = {}
+    if checksums and any(a in S3_ALGORITHMS for a in checksums):
+        response = s3.head_object(Bucket=s3_uri['bucket'], Key=s3_uri['key'], ChecksumMode='ENABLED', **extra)
+        hashes = from_s3(response, checksums)
+    remaining = [a for a in checksums or [] if a not in hashes]
 
-    with open(fout, 'wb') as f:
+    def _download(f):
+        if remaining:
+            f = HashingFile(f, remaining)
         s3.download_fileobj(
             Bucket=s3_uri['bucket'], Key=s3_uri['key'], Fileobj=f, ExtraArgs=extra
         )
+        if remaining:
+            hashes.update(f.hexdigests())
+
+    start = time.perf_counter()
+    cache = cache or get_cache()
+    meta = head(uri, extra=extra, client=s3) if cache is not None else None
+    hit = False
+    if meta is not None and meta['size'] <= cache.max_bytes:
+        version = meta['version_id'] or meta['etag']
+        hit = cache.fetch(cache.key(s3_uri['bucket'], s3_uri['key'], version), fout, _download)
+        if hit and remaining:
+            hashes.update(hash_file(fout, remaining))
+    else:
+        with open(fout, 'wb') as f:
+            _download(f)
+    if not hit:
+        stats.current().transfer('download', uri, os.path.getsize(fout), time.perf_counter() - start)
+    if checksums:
+        return fout, hashes
     return fout
 
 
-def download_json(uri, extra=None):
-    """ Download object from S3 as JSON """
+def download_json(uri, extra=None, client=None):
+    """ Download object from S3 as JSON
+
+    Compressed objects are decompressed, and payloads pointing to another
+    object (see upload_json) are resolved
+    """
     if extra is None:
         extra = REQUESTER_PAYS
-    logger.debug('Downloading %s as JSON' % (uri))
-    s3 = get_client()
+    logger.debug('Downloading %s as JSON', uri)
+    s3 = client or get_client()
     s3_uri = uri_parser(uri)
     response = s3.get_object(
         Bucket=s3_uri['bucket'], Key=s3_uri['key'], **extra
     )
-    return json.loads(response['Body'].read().decode())
+    data = decompress(response['Body'].read())
+    return resolve_pointer(json.loads(data.decode()), extra=extra, client=s3)
+
+
+def upload_json(obj, uri, compression=None, extra=None, client=None):
+    """ Upload object as JSON to S3, optionally compressed with gzip or zstd
+
+    Returns a pointer to the uploaded payload that is resolved by download_json
+    """
+    if extra is None:
+        extra = REQUESTER_PAYS
+    logger.debug('Uploading JSON to %s', uri)
+    s3 = client or get_client()
+    s3_uri = uri_parser(uri)
+    data = json.dumps(obj).encode()
+    size = len(data)
+    if compression == 'gzip':
+        data = gzip.compress(data)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception('zstandard must be installed for zstd compression')
+        data = zstandard.ZstdCompressor().compress(data)
+    elif compression is not None:
+        raise ValueError('Invalid compression %s (choose between: gzip, zstd)' % compression)
+    s3.put_object(Bucket=s3_uri['bucket'], Key=s3_uri['key'], Body=data,
+                  ContentType='application/json', **extra)
+    return {POINTER_KEY: 's3://%s/%s' % (s3_uri['bucket'], s3_uri['key']), 'size': size}
+
 
+def decompress(data):
+    """ Decompress gzip or zstd compressed data, other data is returned as is """
+    if data[0:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[0:4] == ZSTD_MAGIC:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
 
-def upload(filename, uri, extra=None):
-    """ Upload object to S3 uri (bucket + prefix), keeping same base filename """
+
+def is_pointer(obj):
+    """ Check if obj is a pointer to a JSON payload on S3 """
+    return isinstance(obj, dict) and POINTER_KEY in obj and set(obj) <= set([POINTER_KEY, 'size'])
+
+
+def resolve_pointer(obj, extra=None, client=None):
+    """ Return the payload obj points to, or obj if it is not a pointer """
+    if is_pointer(obj):
+        return download_json(obj[POINTER_KEY], extra=extra, client=client)
+    return obj
+
+
+def open_stream(uri, extra=None, client=None):
+    """ Open S3 object as a readable stream, without downloading it first """
+    if extra is None:
+        extra = REQUESTER_PAYS
+    logger.debug('Streaming %s', uri)
+    s3 = client or get_client()
+    s3_uri = uri_parser(uri)
+    response = s3.get_object(Bucket=s3_uri['bucket'], Key=s3_uri['key'], **extra)
+    return response['Body']
+
+
+def upload(filename, uri, extra=None, client=None, config=None, checksums=None):
+    """ Upload object to S3 uri (bucket + prefix), keeping same base filename
+
+    The TransferConfig is picked from the file size unless config is given.
+    If a list of checksum algorithms is given they are computed as the data is
+    read, S3 is asked to store the first one it supports, and
+    (uri, {algorithm: hexdigest}) is returned
+    """
     if extra is None:
         extra = REQUESTER_PAYS
-    logger.debug('Uploading %s to %s' % (filename, uri))
-    s3 = get_client()
+    logger.debug('Uploading %s to %s', filename, uri)
+    s3 = client or get_client()
     s3_uri = uri_parser(uri)
     uri_out = 's3://%s' % os.path.join(s3_uri['bucket'], s3_uri['key'])
+    size = os.path.getsize(filename)
+    if config is None:
+        config = transfer_config(size)
+    if checksums:
+        supported = [a for a in checksums if a in S3_ALGORITHMS]
+        if supported:
+            extra = dict(extra, ChecksumAlgorithm=S3_ALGORITHMS[supported[0]])
+    start = time.perf_counter()
     with open(filename, 'rb') as data:
-        s3.upload_fileobj(data, s3_uri['bucket'], s3_uri['key'], ExtraArgs=extra)
+        if checksums:
+            data = HashingFile(data, checksums)
+        s3.upload_fileobj(data, s3_uri['bucket'], s3_uri['key'], ExtraArgs=extra, Config=config)
+    stats.current().transfer('upload', uri_out, size, time.perf_counter() - start)
+    if checksums:
+        return uri_out, data.hexdigests()
     return uri_out
 
 
-def list_objects(uri, extra=None):
+def upload_many(filenames, uris, extra=None, client=None, workers=None, checksums=None):
+    """ Upload local files to S3 uris in parallel
+
+    Returns a list, in the order of filenames, of dictionaries with the
+    filename, uri, bytes and elapsed seconds of each upload, and its
+    checksums if a list of algorithms is given
+    """
+    s3 = client or get_client()
+
+    def _upload(args):
+        filename, uri = args
+        start = time.time()
+        result = upload(filename, uri, extra=extra, client=s3, checksums=checksums)
+        elapsed = time.time() - start
+        size = os.path.getsize(filename)
+        uri = result[0] if checksums else result
+        logger.debug('Uploaded %s bytes to %s in %.3fs', size, uri, elapsed)
+        report = {'filename': filename, 'uri': uri, 'bytes': size, 'elapsed': elapsed}
+        if checksums:
+            report['checksums'] = result[1]
+        return report
+
+    return run_all(_upload, zip(filenames, uris), workers=workers)
+
+
+def copy(src, dst, extra=None, client=None, workers=None):
+    """ Copy S3 object to dst uri server-side, without downloading it
+
+    Objects larger than MAX_COPY_SIZE are copied in parts, `workers` at a time
+    """
+    if extra is None:
+        extra = REQUESTER_PAYS
+    logger.debug('Copying %s to %s', src, dst)
+    s3 = client or get_client()
+    src_uri = uri_parser(src)
+    dst_uri = uri_parser(dst)
+    source = {'Bucket': src_uri['bucket'], 'Key': src_uri['key']}
+    start = time.perf_counter()
+    meta = head(src, extra=extra, client=s3)
+    if meta is None:
+        raise Exception('No such object %s' % src)
+    if meta['size'] <= MAX_COPY_SIZE:
+        s3.copy_object(CopySource=source, Bucket=dst_uri['bucket'], Key=dst_uri['key'], **extra)
+    else:
+        _copy_parts(s3, source, dst_uri, meta['size'], extra, workers)
+    stats.current().transfer('copy', dst, meta['size'], time.perf_counter() - start)
+    return 's3://%s' % os.path.join(dst_uri['bucket'], dst_uri['key'])
+
+
+def _copy_parts(s3, source, dst_uri, size, extra, workers):
+    """ Copy an object with a multipart upload of parts copied from source """
+    part_size = max(COPY_PART_SIZE, -(-size // MAX_PARTS))
+    upload = s3.create_multipart_upload(Bucket=dst_uri['bucket'], Key=dst_uri['key'], **extra)
+
+    def _copy_part(number):
+        start = (number - 1) * part_size
+        end = min(start + part_size, size) - 1
+        response = s3.upload_part_copy(
+            Bucket=dst_uri['bucket'], Key=dst_uri['key'], UploadId=upload['UploadId'], PartNumber=number,
+            CopySource=source, CopySourceRange='bytes=%s-%s' % (start, end), **extra
+        )
+        return {'ETag': response['CopyPartResult']['ETag'], 'PartNumber': number}
+
+    try:
+        parts = run_all(_copy_part, range(1, -(-size // part_size) + 1), workers=workers)
+        s3.complete_multipart_upload(
+            Bucket=dst_uri['bucket'], Key=dst_uri['key'], UploadId=upload['UploadId'],
+            MultipartUpload={'Parts': parts}, **extra
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=dst_uri['bucket'], Key=dst_uri['key'], UploadId=upload['UploadId'])
+        raise
+
+
+def copy_many(srcs, dsts, extra=None, client=None, workers=None):
+    """ Copy S3 objects to dst uris server-side in parallel, returning dst uris in order """
+    s3 = client or get_client()
+    return run_all(lambda args: copy(args[0], args[1], extra=extra, client=s3), zip(srcs, dsts), workers=workers)
+
+
+def move(src, dst, extra=None, client=None, workers=None):
+    """ Move S3 object to dst uri server-side, returning dst uri """
+    s3 = client or get_client()
+    uri = copy(src, dst, extra=extra, client=s3, workers=workers)
+    s3_uri = uri_parser(src)
+    s3.delete_object(Bucket=s3_uri['bucket'], Key=s3_uri['key'])
+    return uri
+
+
+def list_objects(uri, extra=None, client=None):
     """ Get list of objects within bucket and path """
+    return [obj['uri'] for obj in iter_objects(uri, extra=extra, client=client)]
+
+
+def iter_objects(uri, extra=None, client=None, delimiter=None, prefixes=None, workers=None, page_size=None):
+    """ Iterate over all objects within bucket and path, following continuation tokens
+
+    Yields a dictionary for each object with its uri, key, size, etag,
+    last_modified and storage_class. With a delimiter, the sub-prefixes found up
+    to the first delimiter after the path are listed in parallel, as are the
+    given prefixes (relative to the path). Objects are then not in key order
+    """
     if extra is None:
         extra = REQUESTER_PAYS
-    logger.debug('Listing contents of %s' % uri)
-    s3 = get_client()
+    logger.debug('Listing contents of %s', uri)
+    s3 = client or get_client()
     s3_uri = uri_parser(uri)
-    response = s3.list_objects_v2(Bucket=s3_uri['bucket'], Prefix=s3_uri['key'], **extra)
+    bucket = s3_uri['bucket']
+    # uri_parser drops the trailing slash of a path
+    path = s3_uri['key'] + '/' if uri.endswith('/') and s3_uri['key'] else s3_uri['key']
+
+    def _pages(prefix, delimiter=None):
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if delimiter is not None:
+            kwargs['Delimiter'] = delimiter
+        if page_size is not None:
+            kwargs['PaginationConfig'] = {'PageSize': page_size}
+        for page in s3.get_paginator('list_objects_v2').paginate(**kwargs, **extra):
+            yield page
 
-    filenames = []
-    if 'Contents' in response.keys():
-        for file in response['Contents']:
-            filenames.append(os.path.join('s3://%s' % s3_uri['bucket'], file['Key']))
-    return filenames
+    def _objects(page):
+        return [{
+            'uri': 's3://%s/%s' % (bucket, obj['Key']),
+            'key': obj['Key'],
+            'size': obj['Size'],
+            'etag': obj['ETag'],
+            'last_modified': obj['LastModified'],
+            'storage_class': obj.get('StorageClass', 'STANDARD')
+        } for obj in page.get('Contents', [])]
 
+    if prefixes is not None:
+        prefixes = [path + p for p in prefixes]
+    elif delimiter is not None:
+        prefixes = []
+        for page in _pages(path, delimiter=delimiter):
+            for obj in _objects(page):
+                yield obj
+            prefixes += [p['Prefix'] for p in page.get('CommonPrefixes', [])]
+    else:
+        for page in _pages(path):
+            for obj in _objects(page):
+                yield obj
+        return
 
-def delete(uri, extra=None):
+    # list prefixes in parallel, bounding the number of pages held in memory
+    if workers is None:
+        workers = WORKERS
+    pages = queue.Queue(maxsize=2 * workers)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _list(prefix):
+        try:
+            for page in _pages(prefix):
+                if stop.is_set():
+                    break
+                _put(_objects(page))
+        except Exception as e:
+            _put(e)
+        _put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(prefixes))))
+    try:
+        for prefix in prefixes:
+            executor.submit(_list, prefix)
+        remaining = len(prefixes)
+        while remaining:
+            item = pages.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                for obj in item:
+                    yield obj
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def delete(uri, extra=None, client=None):
     """ Remove an item from S3 """
     if extra is None:
         extra = REQUESTER_PAYS
-    logger.debug('Deleting %s' % uri)
-    s3 = get_client()
+    logger.debug('Deleting %s', uri)
+    s3 = client or get_client()
     s3_uri = uri_parser(uri)
     # TODO - parse response and return success/failure
     try:
@@ -121,18 +522,109 @@ def delete(uri, extra=None):
         return False
 
 
-def exists(uri, extra=None):
+def delete_many(uris, extra=None, client=None, workers=None):
+    """ Remove many items from S3, in batches of up to MAX_DELETE_KEYS keys per bucket run in parallel
+
+    Returns a dictionary for each uri, in order, with the uri, whether it was
+    deleted and the error if it was not
+    """
+    if extra is None:
+        extra = REQUESTER_PAYS
+    uris = list(uris)
+    logger.debug('Deleting %s objects', len(uris))
+    s3 = client or get_client()
+    keys = {}
+    for uri in uris:
+        s3_uri = uri_parser(uri)
+        keys.setdefault(s3_uri['bucket'], {})[s3_uri['key']] = None
+    batches = []
+    for bucket, bucket_keys in keys.items():
+        bucket_keys = list(bucket_keys)
+        for i in range(0, len(bucket_keys), MAX_DELETE_KEYS):
+            batches.append((bucket, bucket_keys[i:i + MAX_DELETE_KEYS]))
+
+    def _delete(batch):
+        bucket, batch_keys = batch
+        try:
+            response = s3.delete_objects(
+                Bucket=bucket, Delete={'Objects': [{'Key': k} for k in batch_keys], 'Quiet': True}, **extra
+            )
+        except Exception as e:
+            return {(bucket, k): str(e) for k in batch_keys}
+        return {(bucket, e['Key']): '%s: %s' % (e.get('Code'), e.get('Message')) for e in response.get('Errors', [])}
+
+    errors = {}
+    for batch_errors in run_all(_delete, batches, workers=workers):
+        errors.update(batch_errors)
+    results = []
+    for uri in uris:
+        s3_uri = uri_parser(uri)
+        error = errors.get((s3_uri['bucket'], s3_uri['key']))
+        results.append({'uri': uri, 'deleted': error is None, 'error': error})
+    return results
+
+
+def delete_prefix(uri, extra=None, client=None, workers=None):
+    """ Remove all items under an S3 path, returning the results of delete_many """
+    s3 = client or get_client()
+    uris = [obj['uri'] for obj in iter_objects(uri, extra=extra, client=s3)]
+    return delete_many(uris, extra=extra, client=s3, workers=workers)
+
+
+def exists(uri, extra=None, client=None):
     """ Check if this URI exists on S3 """
+    logger.debug('Checking existence of %s', uri)
+    return head(uri, extra=extra, client=client) is not None
+
+
+def head(uri, extra=None, client=None):
+    """ Get size, etag, last_modified, storage_class and version_id of an S3 object, or None if it does not exist """
+    from botocore.exceptions import ClientError
     if extra is None:
         extra = REQUESTER_PAYS
-    logger.debug('Checking existence of %s' % uri)
-    s3 = get_client()
+    s3 = client or get_client()
     s3_uri = uri_parser(uri)
     try:
-        s3.get_object(Bucket=s3_uri['bucket'], Key=s3_uri['key'])
-        return True
-    except Exception as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            return False
-        else:
-            raise
+        response = s3.head_object(Bucket=s3_uri['bucket'], Key=s3_uri['key'], **extra)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return {
+        'size': response['ContentLength'],
+        'etag': response['ETag'],
+        'last_modified': response['LastModified'],
+        'storage_class': response.get('StorageClass', 'STANDARD'),
+        'version_id': response.get('VersionId')
+    }
+
+
+def head_many(uris, extra=None, client=None, workers=None, ttl=HEAD_CACHE_TTL):
+    """ Get head of many S3 objects in parallel, in the order of uris
+
+    Results less than ttl seconds old are reused
+    """
+    uris = list(uris)
+    s3 = client or get_client()
+    now = time.time()
+    results = {}
+    with _heads_lock:
+        for uri in uris:
+            cached = _heads.get(uri)
+            if cached is not None and now - cached[0] < ttl:
+                results[uri] = cached[1]
+    missing = [u for u in dict.fromkeys(uris) if u not in results]
+    heads = run_all(lambda uri: head(uri, extra=extra, client=s3), missing, workers=workers)
+    with _heads_lock:
+        for uri, h in zip(missing, heads):
+            _heads[uri] = (now, h)
+            results[uri] = h
+        # drop expired results
+        for uri in [u for u, cached in _heads.items() if now - cached[0] >= ttl]:
+            del _heads[uri]
+    return [results[uri] for uri in uris]
+
+
+def exists_many(uris, extra=None, client=None, workers=None, ttl=HEAD_CACHE_TTL):
+    """ Check if each of uris exists on S3, in parallel """
+    return [h is not None for h in head_many(uris, extra=extra, client=client, workers=workers, ttl=ttl)]
@@ -0,0 +1,198 @@
+import os
+import time
+import threading
+import contextvars
+
+# CloudWatch namespace of metrics in run summaries
+NAMESPACE = os.getenv('CUMULUS_STATS_NAMESPACE', 'CumulusProcess')
+
+# stats of the run in progress in this context
+_current = contextvars.ContextVar('cumulus_stats', default=None)
+
+# stats of all runs in progress, used by threads started outside of a run's context (e.g. by boto3)
+_active = []
+_active_lock = threading.Lock()
+
+
+def enabled():
+    """ Check if stats are collected, set with CUMULUS_STATS """
+    return os.getenv('CUMULUS_STATS', '').lower() in ('1', 'true', 'yes')
+
+
+class _Span(object):
+    """ Context manager timing a block of code """
+
+    def __init__(self, stats, name, fields):
+        self.stats = stats
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_span(self.name, time.perf_counter() - self.start, **self.fields)
+        return False
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullStats(object):
+    """ Stats that record nothing, used when stats are disabled """
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, **fields):
+        return self._span
+
+    def add_span(self, name, elapsed, **fields):
+        pass
+
+    def transfer(self, op, uri, nbytes, elapsed):
+        pass
+
+    def retry(self, count=1):
+        pass
+
+    def activate(self):
+        return self._span
+
+    def summary(self):
+        return {}
+
+
+NULL = NullStats()
+
+
+class Stats(object):
+    """ Timing spans of the phases of a run, and metrics of S3 transfers and retries """
+
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self.transfers = []
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def span(self, name, **fields):
+        """ Context manager recording the time spent in a block as a span """
+        return _Span(self, name, fields)
+
+    def add_span(self, name, elapsed, **fields):
+        """ Record a span of elapsed seconds """
+        span = dict(fields, name=name, elapsed=elapsed)
+        with self._lock:
+            self.spans.append(span)
+
+    def transfer(self, op, uri, nbytes, elapsed):
+        """ Record an S3 transfer (download, upload or copy) of nbytes taking elapsed seconds """
+        transfer = {'op': op, 'uri': uri, 'bytes': nbytes, 'elapsed': elapsed}
+        with self._lock:
+            self.transfers.append(transfer)
+
+    def retry(self, count=1):
+        """ Record retried AWS requests """
+        with self._lock:
+            self.retries += count
+
+    def activate(self):
+        """ Context manager making these the stats that s3 functions record to """
+        return _Activation(self)
+
+    def summary(self):
+        """ Total seconds by span name, and totals by transfer operation """
+        with self._lock:
+            spans = list(self.spans)
+            transfers = list(self.transfers)
+        phases = {}
+        for span in spans:
+            phases[span['name']] = phases.get(span['name'], 0) + span['elapsed']
+        ops = {}
+        for t in transfers:
+            op = ops.setdefault(t['op'], {'count': 0, 'bytes': 0, 'elapsed': 0})
+            op['count'] += 1
+            op['bytes'] += t['bytes']
+            op['elapsed'] += t['elapsed']
+        for op in ops.values():
+            op['throughput'] = op['bytes'] / op['elapsed'] if op['elapsed'] else 0
+        return {'phases': phases, 'transfers': ops, 'retries': self.retries}
+
+    def emf(self, dimensions=None, namespace=None):
+        """ Summary as a CloudWatch Embedded Metric Format record """
+        summary = self.summary()
+        dimensions = dimensions or {}
+        record = dict(dimensions)
+        metrics = []
+        for name, elapsed in summary['phases'].items():
+            metrics.append({'Name': '%sTime' % name, 'Unit': 'Milliseconds'})
+            record['%sTime' % name] = elapsed * 1000
+        for op, totals in summary['transfers'].items():
+            metrics.append({'Name': '%sBytes' % op, 'Unit': 'Bytes'})
+            metrics.append({'Name': '%sThroughput' % op, 'Unit': 'Bytes/Second'})
+            record['%sBytes' % op] = totals['bytes']
+            record['%sThroughput' % op] = totals['throughput']
+        metrics.append({'Name': 'Retries', 'Unit': 'Count'})
+        record['Retries'] = summary['retries']
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace or NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': metrics
+            }]
+        }
+        record['stats'] = summary
+        return record
+
+
+class _Activation(object):
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.token = _current.set(self.stats)
+        with _active_lock:
+            _active.append(self.stats)
+        return self.stats
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        with _active_lock:
+            _active.remove(self.stats)
+        return False
+
+
+def current():
+    """ Stats of the run in progress, NULL if there is none
+
+    In threads without the run's context, such as those of boto3 transfers,
+    the run in progress is only known when there is a single one
+    """
+    stats = _current.get()
+    if stats is not None:
+        return stats
+    try:
+        if len(_active) == 1:
+            return _active[0]
+    except IndexError:
+        pass
+    return NULL
+
+
+def _count_retries(parsed=None, **kwargs):
+    """ botocore after-call handler recording retried requests """
+    if parsed:
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if retries:
+            current().retry(retries)
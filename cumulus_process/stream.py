@@ -0,0 +1,130 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from cumulus_process.s3 import get_client, uri_parser, REQUESTER_PAYS
+
+MB = 1024 ** 2
+
+
+class S3File(io.RawIOBase):
+    """ Seekable, read-only file object for an S3 object, reading only the bytes needed with ranged GETs
+
+    The object is read in blocks of block_size bytes, of which the max_blocks most
+    recently used are kept in memory. Blocks needed by a read are fetched
+    concurrently, and the next `readahead` blocks are fetched in the background
+    """
+
+    def __init__(self, uri, block_size=MB, max_blocks=32, readahead=2, workers=4, extra=None, client=None):
+        super(S3File, self).__init__()
+        if extra is None:
+            extra = REQUESTER_PAYS
+        self.name = uri
+        self.block_size = block_size
+        self.max_blocks = max(max_blocks, readahead + 1)
+        self.readahead = readahead
+        self.extra = extra
+        self.client = client or get_client()
+        s3_uri = uri_parser(uri)
+        self.bucket = s3_uri['bucket']
+        self.key = s3_uri['key']
+        self.size = self.client.head_object(Bucket=self.bucket, Key=self.key, **extra)['ContentLength']
+        self.pos = 0
+        self.requests = 0
+        self._blocks = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence %s' % whence)
+        if pos < 0:
+            raise ValueError('Negative seek position %s' % pos)
+        self.pos = pos
+        return self.pos
+
+    def readinto(self, b):
+        """ Read up to len(b) bytes into b, returning the number of bytes read """
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        view = memoryview(b).cast('B')
+        n = min(len(view), self.size - self.pos)
+        if n <= 0:
+            return 0
+        first = self.pos // self.block_size
+        last = (self.pos + n - 1) // self.block_size
+        futures = [self._block(i) for i in range(first, last + 1)]
+        nblocks = -(-self.size // self.block_size)
+        for i in range(last + 1, min(last + 1 + self.readahead, nblocks)):
+            self._block(i)
+        written = 0
+        for i, future in zip(range(first, last + 1), futures):
+            data = future.result()
+            start = self.pos + written - i * self.block_size
+            chunk = data[start:start + n - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+        self.pos += written
+        return written
+
+    def readall(self):
+        """ Read from the current position to the end of the object """
+        b = bytearray(max(self.size - self.pos, 0))
+        n = self.readinto(b)
+        return bytes(b[:n])
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._blocks.clear()
+        super(S3File, self).close()
+
+    def _block(self, i):
+        """ Future for the data of block i, fetching it if not cached or pending """
+        with self._lock:
+            if i in self._blocks:
+                self._blocks.move_to_end(i)
+                future = Future()
+                future.set_result(self._blocks[i])
+                return future
+            if i not in self._pending:
+                self._pending[i] = self._executor.submit(self._fetch, i)
+            return self._pending[i]
+
+    def _fetch(self, i):
+        """ Get block i with a ranged GET and add it to the cache """
+        start = i * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                              Range='bytes=%s-%s' % (start, end), **self.extra)
+            data = response['Body'].read()
+        except Exception:
+            # let a later read try again
+            with self._lock:
+                self._pending.pop(i, None)
+            raise
+        with self._lock:
+            self.requests += 1
+            self._pending.pop(i, None)
+            self._blocks[i] = data
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return data
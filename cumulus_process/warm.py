@@ -0,0 +1,70 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from cumulus_process.s3 import get_client
+
+logger = logging.getLogger(__name__)
+
+# state kept at module scope, reused by every invocation in a warm (Lambda) container
+_started = time.time()
+_invocations = 0
+_lock = threading.Lock()
+
+# scratch directory of each thread, created on first use and emptied between invocations
+_local = threading.local()
+
+
+def invocation():
+    """ Count an invocation, returning if it is the cold start of this container """
+    global _invocations
+    with _lock:
+        _invocations += 1
+        count = _invocations
+    return {'cold': count == 1, 'invocation': count, 'container_age': time.time() - _started}
+
+
+def scratch_dir():
+    """ Empty scratch directory for this thread, created once (under CUMULUS_SCRATCH_DIR if set) and reused """
+    path = getattr(_local, 'path', None)
+    if path is None or not os.path.isdir(path):
+        base = os.getenv('CUMULUS_SCRATCH_DIR')
+        if base:
+            os.makedirs(base, exist_ok=True)
+        path = _local.path = tempfile.mkdtemp(prefix='cumulus-', dir=base)
+    else:
+        empty(path)
+    return path
+
+
+def is_scratch(path):
+    """ Check if path is the scratch directory of this thread """
+    return path is not None and path == getattr(_local, 'path', None)
+
+
+def empty(path):
+    """ Remove everything in a directory, keeping the directory """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+
+def prewarm(services=('s3',), buckets=()):
+    """ Create clients ahead of the first invocation (e.g. at module scope of a Lambda handler)
+
+    A HEAD request is made to each of buckets, so that connections to S3 are
+    already open when the first invocation needs them
+    """
+    clients = {service: get_client(service) for service in services}
+    s3 = clients.get('s3') or get_client()
+    for bucket in buckets:
+        try:
+            s3.head_bucket(Bucket=bucket)
+        except Exception as e:
+            logger.warning('Could not prewarm connection to %s: %s', bucket, e)
+    return clients
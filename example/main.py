@@ -1,5 +1,5 @@
 import os
-from cumulus_process import Process, helpers
+from cumulus_process import Process, s3
 
 
 class Modis(Process):
@@ -54,19 +54,20 @@ class Modis(Process):
         # matches each regex
         self.fetch('hdf', remote=True)[0]
 
-        # and the thumbnail
-        thumbnail = self.fetch('thumbnail')[0]
+        # and the thumbnail, which is only renamed so it is not downloaded
+        thumbnail = self.fetch('thumbnail', remote=True)[0]
 
         # and the metadata
         self.fetch('meta')[0]
 
-        # now lets upload all one of the downloaded files with a new name to the remote
-        # location given in the config
-        new_file = os.path.join(os.path.dirname(thumbnail), 'new_file.jpg')
-        os.rename(thumbnail, new_file)
-        outputs = helpers.upload_files([new_file], self.config['bucket'], self.config['fileStagingDir'])
+        # now lets copy the thumbnail with a new name to the remote location given
+        # in the config. the copy is made by S3 without passing through this machine.
+        # local files can be uploaded with helpers.upload_files, and remote files
+        # copied without renaming with helpers.copy_files
+        new_file = os.path.join('s3://', self.config['bucket'], self.config['fileStagingDir'], 'new_file.jpg')
+        outputs = [s3.copy(thumbnail, new_file)]
 
-        # and now return the list of uploaded files
+        # and now return the list of published files
         return self.input + outputs
 
 
@@ -23,7 +23,7 @@ setup(
     classifiers=[
         'Programming Language :: Python :: 3.12'
     ],
-    packages=find_packages(exclude=['docs', 'tests*']),
+    packages=find_packages(exclude=['docs', 'tests*', 'benchmarks*']),
     include_package_data=True,
     install_requires=install_requires,
 )
@@ -0,0 +1,77 @@
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+from cumulus_process.cache import DownloadCache
+
+
+class TestCache(unittest.TestCase):
+    """ Test the local download cache """
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.cache = DownloadCache(os.path.join(self.path, 'cache'), max_bytes=25)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def fill(self, data):
+        fills = []
+
+        def _fill(f):
+            fills.append(data)
+            f.write(data)
+        return _fill, fills
+
+    def test_fetch(self):
+        """ Populate cache on a miss, and link it on a hit """
+        fill, fills = self.fill(b'0123456789')
+        key = self.cache.key('bucket', 'key', 'etag')
+        fout = os.path.join(self.path, 'file-1')
+        self.assertFalse(self.cache.fetch(key, fout, fill))
+        self.assertTrue(self.cache.fetch(key, os.path.join(self.path, 'file-2'), fill))
+        self.assertEqual(len(fills), 1)
+        with open(os.path.join(self.path, 'file-2'), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+        self.assertEqual(self.cache.stats['bytes_saved'], 10)
+
+    def test_fetch_copy(self):
+        """ Files from a hit can be modified without changing the cached copy """
+        fill, fills = self.fill(b'0123456789')
+        key = self.cache.key('bucket', 'key', 'etag')
+        fout = os.path.join(self.path, 'file-1')
+        self.cache.fetch(key, fout, fill)
+        self.assertNotEqual(os.stat(fout).st_ino, os.stat(self.cache.filename(key)).st_ino)
+        with open(fout, 'wb') as f:
+            f.write(b'changed')
+        self.assertTrue(self.cache.fetch(key, os.path.join(self.path, 'file-2'), fill))
+        with open(os.path.join(self.path, 'file-2'), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_fetch_hardlink(self):
+        """ Hits are hard links to the cached copy when enabled """
+        cache = DownloadCache(os.path.join(self.path, 'cache'), hardlink=True)
+        fill, fills = self.fill(b'0123456789')
+        key = cache.key('bucket', 'key', 'etag')
+        fout = os.path.join(self.path, 'file-1')
+        cache.fetch(key, fout, fill)
+        self.assertEqual(os.stat(fout).st_ino, os.stat(cache.filename(key)).st_ino)
+
+    def test_key(self):
+        """ Keys differ by object version """
+        self.assertNotEqual(self.cache.key('bucket', 'key', '1'), self.cache.key('bucket', 'key', '2'))
+
+    def test_evict(self):
+        """ Least recently used files are evicted to stay within budget """
+        keys = [self.cache.key('bucket', 'key-%s' % i, 'etag') for i in range(3)]
+        for i, key in enumerate(keys):
+            fill, fills = self.fill(b'0123456789')
+            self.cache.fetch(key, os.path.join(self.path, 'file-%s' % i), fill)
+            # make sure modification times differ
+            os.utime(self.cache.filename(key), (i, i))
+        self.cache.evict()
+        self.assertFalse(os.path.exists(self.cache.filename(keys[0])))
+        self.assertTrue(os.path.exists(self.cache.filename(keys[2])))
+        self.assertEqual(self.cache.stats['evictions'], 1)
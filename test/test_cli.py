@@ -4,10 +4,12 @@ This testing module relies on some testing data available in s3://cumulus-intern
 
 import os
 import sys
+import json
 import unittest
 from tempfile import mkdtemp
+from mock import patch
 from cumulus_process import Process
-from cumulus_process.cli import parse_args, cli
+from cumulus_process.cli import parse_args, cli, is_batch
 
 if not os.getenv('LOCALSTACK_HOST'):
     raise Exception('LOCALSTACK_HOST must be set as env variable before running tests')
@@ -65,3 +67,45 @@ class Test(unittest.TestCase):
         """ Test CLI function without payload """
         sys.argv = ('program process test-1.txt test-2.txt --path %s' % mkdtemp()).split(' ')
         cli(Process)
+
+    def test_cli_activity(self):
+        """ Run an activity with its worker options """
+        sys.argv = 'program activity --arn arn --workers 3 --mode process --heartbeat 10'.split(' ')
+        with patch.object(Process, 'cumulus_activity') as activity:
+            cli(Process)
+        activity.assert_called_once_with('arn', workers=3, mode='process', heartbeat=10)
+
+    def test_parse_args_batch(self):
+        """ Parse batch arguments """
+        args = parse_args(Process, 'payload messages.jsonl --workers 4 --output out.jsonl'.split(' '))
+        self.assertEqual(args['workers'], 4)
+        self.assertEqual(args['output'], 'out.jsonl')
+        self.assertTrue(is_batch(args['payload']))
+        self.assertTrue(is_batch('s3://bucket/messages/'))
+        self.assertFalse(is_batch('s3://bucket/message.json'))
+
+    def test_cli_batch(self):
+        """ Process a batch of local files from a JSON lines file """
+        path = mkdtemp()
+        source = os.path.join(path, 'messages.jsonl')
+        with open(source, 'w') as f:
+            f.write('["test-1.txt"]\n\n{"input": ["test-2.txt"]}\n')
+        fout = os.path.join(path, 'results.jsonl')
+
+        class OutputProcess(Process):
+            def process(self):
+                fname = os.path.join(self.path, 'output-%s' % os.path.basename(self.input[0]))
+                with open(fname, 'w') as f:
+                    f.write(str(self.input))
+                return [fname]
+
+        sys.argv = ['program', 'process', '--batch', source, '--workers', '1', '--output', fout]
+        summary = cli(OutputProcess)
+        self.assertEqual(summary['total'], 2)
+        self.assertEqual(summary['succeeded'], 2)
+        with open(fout) as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual([r['index'] for r in results], [0, 1])
+        # outputs of earlier payloads are kept
+        for r in results:
+            self.assertTrue(os.path.exists(r['output'][0]))
@@ -0,0 +1,89 @@
+import time
+import logging
+import unittest
+from testfixtures import LogCapture
+from cumulus_process import commands
+from cumulus_process.commands import run_command, run_commands, CommandError
+
+
+class TestCommands(unittest.TestCase):
+    """ Test running system commands """
+
+    def test_run_command(self):
+        """ Run a command, logging its output line by line """
+        with LogCapture('cumulus_process.commands', level=logging.DEBUG) as lc:
+            result = run_command('sh -c "echo one; echo two >&2"')
+        self.assertEqual(result['returncode'], 0)
+        self.assertEqual(result['output'], b'one\ntwo\n')
+        messages = [r.getMessage() for r in lc.records]
+        self.assertEqual(messages[1:], ['one', 'two'])
+        self.assertTrue(result['cpu_time'] >= 0)
+        self.assertTrue(result['max_rss'] > 0)
+
+    def test_run_command_argv(self):
+        """ Run a command from an argv list """
+        result = run_command(['printf', '%s', 'a b'])
+        self.assertEqual(result['output'], b'a b')
+
+    def test_run_command_tail(self):
+        """ Keep the last lines of output """
+        result = run_command(['seq', '1', '10000'], tail=3)
+        self.assertEqual(result['output'], b'9998\n9999\n10000\n')
+
+    def test_run_command_error(self):
+        """ Raise a CommandError with the result of a failed command """
+        with self.assertRaises(CommandError) as cm:
+            run_command('sh -c "echo failed; exit 3"')
+        self.assertTrue(isinstance(cm.exception, RuntimeError))
+        self.assertEqual(cm.exception.result['returncode'], 3)
+        self.assertEqual(cm.exception.result['output'], b'failed\n')
+
+    def test_run_command_timeout(self):
+        """ Kill a command and the processes it started when it times out """
+        start = time.time()
+        with self.assertRaises(CommandError) as cm:
+            run_command(['sh', '-c', 'sleep 30 & sleep 30'], timeout=0.5)
+        self.assertTrue(time.time() - start < 5)
+        self.assertTrue('Timeout' in str(cm.exception))
+        self.assertEqual(cm.exception.result['returncode'], -15)
+
+    def test_run_command_background_timeout(self):
+        """ Kill processes holding the output open once the command exits, when it times out """
+        start = time.time()
+        with self.assertRaises(CommandError) as cm:
+            run_command(['sh', '-c', 'sleep 30 & echo hi'], timeout=0.5)
+        self.assertTrue(time.time() - start < 5)
+        self.assertTrue('Timeout' in str(cm.exception))
+        self.assertEqual(cm.exception.result['returncode'], 0)
+        self.assertEqual(cm.exception.result['output'], b'hi\n')
+
+    def test_run_command_background(self):
+        """ Stop reading output held open by a process left running, without timeout """
+        grace = commands.KILL_GRACE
+        commands.KILL_GRACE = 0.5
+        try:
+            start = time.time()
+            result = run_command(['sh', '-c', 'sleep 30 & echo hi'])
+        finally:
+            commands.KILL_GRACE = grace
+        # output is read for up to KILL_GRACE seconds once the command exits
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(result['output'], b'hi\n')
+
+    def test_run_command_kill(self):
+        """ Kill a command ignoring SIGTERM """
+        grace = commands.KILL_GRACE
+        commands.KILL_GRACE = 0.2
+        try:
+            with self.assertRaises(CommandError) as cm:
+                run_command(['sh', '-c', 'trap "" TERM; sleep 30'], timeout=0.2)
+        finally:
+            commands.KILL_GRACE = grace
+        self.assertEqual(cm.exception.result['returncode'], -9)
+
+    def test_run_commands(self):
+        """ Run commands in parallel, keeping order """
+        start = time.time()
+        results = run_commands([['sh', '-c', 'sleep 0.5; echo %s' % i] for i in range(4)], concurrency=4)
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual([r['output'] for r in results], [b'%d\n' % i for i in range(4)])
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import uuid
+import queue
+import signal
+import threading
+import unittest
+import multiprocessing
+from mock import patch
+from cumulus_process import handlers, s3
+
+if not os.getenv('LOCALSTACK_HOST'):
+    raise Exception('LOCALSTACK_HOST must be set as env variable before running tests')
+
+
+class FakeSFN(object):
+    """ Local stand-in for the Step Functions activity API """
+
+    def __init__(self, inputs):
+        self.count = len(inputs)
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.tasks = [{'taskToken': str(i), 'input': json.dumps(inp)} for i, inp in enumerate(inputs)]
+        self.success = {}
+        self.failure = {}
+        self.heartbeats = []
+
+    def get_activity_task(self, activityArn, workerName):
+        with self.lock:
+            if self.tasks:
+                return self.tasks.pop(0)
+        time.sleep(0.01)
+        return {}
+
+    def send_task_heartbeat(self, taskToken):
+        with self.lock:
+            self.heartbeats.append(taskToken)
+
+    def send_task_success(self, taskToken, output):
+        with self.lock:
+            self.success[taskToken] = json.loads(output)
+        self.check_finished()
+
+    def send_task_failure(self, taskToken, error, cause):
+        with self.lock:
+            self.failure[taskToken] = error
+        self.check_finished()
+
+    def check_finished(self):
+        with self.lock:
+            if len(self.success) + len(self.failure) == self.count:
+                self.finished.set()
+
+
+class SharedSFN(object):
+    """ Stand-in for the Step Functions activity API shared by worker processes, stopping the activity when done """
+
+    def __init__(self, manager, inputs):
+        self.count = len(inputs)
+        self.pid = os.getpid()
+        self.lock = manager.Lock()
+        self.tasks = manager.Queue()
+        for i, inp in enumerate(inputs):
+            self.tasks.put({'taskToken': str(i), 'input': json.dumps(inp)})
+        self.success = manager.dict()
+        self.workers = manager.dict()
+
+    def get_activity_task(self, activityArn, workerName):
+        try:
+            return self.tasks.get(timeout=0.01)
+        except queue.Empty:
+            return {}
+
+    def send_task_success(self, taskToken, output):
+        with self.lock:
+            self.success[taskToken] = json.loads(output)
+            self.workers[os.getpid()] = True
+            if len(self.success) == self.count:
+                # stop the activity like Lambda or ECS would
+                os.kill(self.pid, signal.SIGTERM)
+
+
+def double(event):
+    time.sleep(0.02)
+    return event['value'] * 2
+
+
+class TestActivity(unittest.TestCase):
+    """ Test running activities against a stubbed Step Functions """
+
+    def run_activity(self, sfn, handler, workers):
+        """ Run activity until all tasks have been completed """
+        return handlers.activity(handler, 'arn', workers=workers, sfn=sfn, stop=sfn.finished)
+
+    def test_get_and_run_task(self):
+        """ Run a single task """
+        sfn = FakeSFN([{'value': 1}])
+        status = handlers.get_and_run_task(lambda event: event['value'] + 1, sfn, 'arn')
+        self.assertEqual(status, 'succeeded')
+        self.assertEqual(sfn.success['0'], 2)
+        self.assertEqual(handlers.get_and_run_task(lambda event: event, sfn, 'arn'), 'empty')
+
+    def test_activity_workers(self):
+        """ Run tasks concurrently on several workers """
+        sfn = FakeSFN([{'value': i} for i in range(20)])
+        running = []
+        peak = []
+
+        def handler(event):
+            running.append(event)
+            peak.append(len(running))
+            time.sleep(0.02)
+            running.remove(event)
+            if event['value'] == 5:
+                raise Exception('bad task')
+            return event['value']
+
+        stats = self.run_activity(sfn, handler, workers=4)
+        self.assertEqual(len(stats), 4)
+        self.assertEqual(len(sfn.success), 19)
+        self.assertEqual(list(sfn.failure), ['5'])
+        self.assertEqual(sum(s['succeeded'] for s in stats), 19)
+        self.assertEqual(sum(s['failed'] for s in stats), 1)
+        self.assertTrue(1 < max(peak) <= 4)
+
+    def test_activity_single_worker(self):
+        """ Run tasks one at a time """
+        sfn = FakeSFN([{'value': i} for i in range(3)])
+        stats = self.run_activity(sfn, lambda event: event, workers=1)
+        self.assertEqual(stats[0]['succeeded'], 3)
+
+    def test_activity_worker_error(self):
+        """ Stop all workers and raise when a worker fails """
+        sfn = FakeSFN([{'value': i} for i in range(3)])
+        get_activity_task = sfn.get_activity_task
+        errors = []
+
+        def fail_once(**kwargs):
+            if not errors:
+                errors.append(1)
+                raise RuntimeError('throttled')
+            return get_activity_task(**kwargs)
+
+        sfn.get_activity_task = fail_once
+        with self.assertRaises(RuntimeError):
+            handlers.activity(lambda event: event, 'arn', workers=2, sfn=sfn, stop=threading.Event())
+
+    def test_activity_process(self):
+        """ Run tasks on worker processes until stopped by SIGTERM """
+        manager = multiprocessing.Manager()
+        try:
+            sfn = SharedSFN(manager, [{'value': i} for i in range(10)])
+            with patch('cumulus_process.handlers.get_client', return_value=sfn):
+                stats = handlers.activity(double, 'arn', workers=2, mode='process', heartbeat=0)
+            self.assertEqual(dict(sfn.success), {str(i): i * 2 for i in range(10)})
+            self.assertEqual(len(stats), 2)
+            self.assertEqual(sum(s['succeeded'] for s in stats), 10)
+            self.assertTrue(os.getpid() not in sfn.workers)
+        finally:
+            manager.shutdown()
+        # the manager sharing stop was shut down
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_activity_process_sfn(self):
+        """ Clients can't be shared with worker processes """
+        with self.assertRaises(ValueError):
+            handlers.activity(lambda event: event, 'arn', mode='process', sfn=FakeSFN([]))
+
+    def test_activity_invalid_mode(self):
+        """ Only thread and process modes are supported """
+        with self.assertRaises(ValueError):
+            handlers.activity(lambda event: event, 'arn', mode='fiber')
+
+
+class TestHeartbeat(unittest.TestCase):
+    """ Test heartbeats of running tasks """
+
+    def test_heartbeat_thread(self):
+        """ Heartbeats are sent while a task runs, and stop after """
+        sfn = FakeSFN([{'value': 1}])
+        handler = lambda event: time.sleep(0.2)
+        handlers.get_and_run_task(handler, sfn, 'arn', heartbeat=0.02)
+        count = len(sfn.heartbeats)
+        self.assertTrue(count >= 3)
+        self.assertEqual(set(sfn.heartbeats), set(['0']))
+        time.sleep(0.1)
+        self.assertEqual(len(sfn.heartbeats), count)
+
+    def test_heartbeat_progress(self):
+        """ Report progress from the task """
+        sfn = FakeSFN([{'value': 1}])
+
+        def handler(event):
+            self.assertTrue(handlers.heartbeat('halfway'))
+            return event
+
+        handlers.get_and_run_task(handler, sfn, 'arn', heartbeat=0)
+        self.assertEqual(sfn.heartbeats, ['0'])
+        # no task running
+        self.assertFalse(handlers.heartbeat('done'))
+
+
+class TestSpill(unittest.TestCase):
+    """ Test writing large outputs to S3 """
+
+    bucket = str(uuid.uuid4())
+    uri = 's3://%s/spill' % bucket
+
+    @classmethod
+    def setUpClass(cls):
+        cls.s3 = s3.get_client()
+        cls.s3.create_bucket(Bucket=cls.bucket)
+
+    @classmethod
+    def tearDownClass(cls):
+        for uri in s3.list_objects('s3://%s' % cls.bucket):
+            s3.delete(uri)
+        cls.s3.delete_bucket(Bucket=cls.bucket)
+
+    def test_spill_small(self):
+        """ Small outputs are returned as is """
+        output = {'files': ['file-1']}
+        self.assertEqual(handlers.spill(output, self.uri), output)
+
+    def test_spill(self):
+        """ Large outputs are written to S3 """
+        output = {'files': ['s3://bucket/file-%s.hdf' % i for i in range(5000)]}
+        pointer = handlers.spill(output, self.uri)
+        self.assertTrue(s3.is_pointer(pointer))
+        self.assertTrue(pointer[s3.POINTER_KEY].endswith('.json.gz'))
+        self.assertEqual(s3.resolve_pointer(pointer), output)
+
+    def test_activity_spill(self):
+        """ Activity inputs and outputs are resolved and spilled """
+        output = ['s3://bucket/file-%s.hdf' % i for i in range(5000)]
+        pointer = s3.upload_json({'input': 'large'}, self.uri + '/input.json')
+        sfn = FakeSFN([pointer])
+        handlers.SFN_SPILL_URI = self.uri
+        try:
+            handlers.get_and_run_task(lambda event: output if event['input'] == 'large' else None, sfn, 'arn')
+        finally:
+            handlers.SFN_SPILL_URI = None
+        self.assertEqual(s3.resolve_pointer(sfn.success['0']), output)
+
+    def test_activity_no_spill(self):
+        """ Outputs are returned as is when spilling is off, e.g. for Cumulus messages """
+        output = ['s3://bucket/file-%s.hdf' % i for i in range(5000)]
+        sfn = FakeSFN([{'input': 'large'}])
+        handlers.SFN_SPILL_URI = self.uri
+        try:
+            handlers.get_and_run_task(lambda event: output, sfn, 'arn', spill_outputs=False)
+        finally:
+            handlers.SFN_SPILL_URI = None
+        self.assertEqual(sfn.success['0'], output)
@@ -0,0 +1,139 @@
+import os
+import gzip
+import uuid
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+from xml.dom.minidom import parseString
+from cumulus_process import s3, helpers
+
+if not os.getenv('LOCALSTACK_HOST'):
+    raise Exception('LOCALSTACK_HOST must be set as env variable before running tests')
+
+
+class Test(unittest.TestCase):
+    """ Test helper functions """
+
+    bucket = str(uuid.uuid4())
+    path = mkdtemp()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.s3 = s3.get_client()
+        cls.s3.create_bucket(Bucket=cls.bucket)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s3.delete_bucket(Bucket=cls.bucket)
+        rmtree(cls.path)
+
+    def create_files(self, names):
+        """ Create small local files """
+        fouts = []
+        for name in names:
+            fout = os.path.join(self.path, name)
+            with open(fout, 'w') as f:
+                f.write(name)
+            fouts.append(fout)
+        return fouts
+
+    def test_upload_files(self):
+        """ Upload files in parallel, keeping order """
+        files = self.create_files(['upload-%s.txt' % i for i in range(6)])
+        uris = helpers.upload_files(files, self.bucket, 'prefix', workers=3)
+        self.assertEqual(uris, ['s3://%s/prefix/upload-%s.txt' % (self.bucket, i) for i in range(6)])
+        for uri in uris:
+            self.assertTrue(s3.exists(uri))
+            s3.delete(uri)
+
+    def test_upload_files_report(self):
+        """ Report bytes and elapsed time of uploads """
+        files = self.create_files(['report.txt'])
+        report = helpers.upload_files(files, self.bucket, 'prefix', report=True)
+        self.assertEqual(report[0]['bytes'], len('report.txt'))
+        self.assertTrue(report[0]['elapsed'] >= 0)
+        s3.delete(report[0]['uri'])
+
+    def test_copy_files(self):
+        """ Copy remote files to a new prefix """
+        files = self.create_files(['copy-%s.txt' % i for i in range(3)])
+        uris = helpers.upload_files(files, self.bucket, 'src')
+        copies = helpers.copy_files(uris, self.bucket, 'dst')
+        self.assertEqual(copies, ['s3://%s/dst/copy-%s.txt' % (self.bucket, i) for i in range(3)])
+        self.assertTrue(all(s3.exists_many(copies, ttl=0)))
+        s3.delete_many(uris + copies)
+
+    def create_gzip(self, name, data):
+        """ Create local gzipped file """
+        fout = os.path.join(self.path, name)
+        with gzip.open(fout, 'wb') as f:
+            f.write(data)
+        return fout
+
+    def test_gunzip(self):
+        """ Unzip a local file in small chunks """
+        data = os.urandom(100000)
+        fname = self.create_gzip('test.bin.gz', data)
+        fout = helpers.gunzip(fname, remove=True, bufsize=1024)
+        self.assertEqual(fout, os.path.join(self.path, 'test.bin'))
+        self.assertFalse(os.path.exists(fname))
+        with open(fout, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_gunzip_many(self):
+        """ Unzip several files in parallel """
+        fnames = [self.create_gzip('many-%s.txt.gz' % i, b'file %d' % i) for i in range(4)]
+        fouts = helpers.gunzip_many(fnames, workers=2)
+        self.assertEqual(fouts, [os.path.splitext(f)[0] for f in fnames])
+        with open(fouts[3], 'rb') as f:
+            self.assertEqual(f.read(), b'file 3')
+
+    def test_gunzip_s3(self):
+        """ Unzip a file while streaming it from S3 """
+        self.s3.put_object(Bucket=self.bucket, Key='prefix/stream.txt.gz', Body=gzip.compress(b'streamed'))
+        uri = 's3://%s/prefix/stream.txt.gz' % self.bucket
+        fout = helpers.gunzip(uri, path=self.path)
+        self.assertEqual(fout, os.path.join(self.path, 'stream.txt'))
+        with open(fout, 'rb') as f:
+            self.assertEqual(f.read(), b'streamed')
+        s3.delete(uri)
+
+    def test_dict_to_xml(self):
+        """ Convert dictionary metadata to XML """
+        meta = {'Name': 'a<b & "c"', 'Flag': True, 'Empty': None, 'Files': ['f1', 'f2'],
+                'Boundary': {'Points': [{'Lat': 1}, {'Lat': 2}]}}
+        xml = helpers.dict_to_xml(meta)
+        self.assertEqual(xml, (
+            '<?xml version="1.0" encoding="UTF-8" ?><Granule>'
+            '<Name>a&lt;b &amp; &quot;c&quot;</Name><Flag>true</Flag><Empty></Empty>'
+            '<Files><File>f1</File><File>f2</File></Files>'
+            '<Boundary><Point><Lat>1</Lat></Point><Point><Lat>2</Lat></Point></Boundary></Granule>'
+        ))
+        self.assertEqual(helpers.dict_to_xml({'a': 1}, root=None), '<a>1</a>')
+
+    def test_dict_to_xml_pretty(self):
+        """ Pretty print XML like minidom """
+        meta = {'Name': 'name', 'Empty': '', 'Files': ['f1']}
+        xml = helpers.dict_to_xml(meta, pretty=True)
+        self.assertEqual(xml, (
+            '<?xml version="1.0" ?>\n<Granule>\n\t<Name>name</Name>\n\t<Empty/>\n'
+            '\t<Files>\n\t\t<File>f1</File>\n\t</Files>\n</Granule>\n'
+        ))
+        self.assertEqual(parseString(xml).documentElement.tagName, 'Granule')
+
+    def test_dict_to_xml_names(self):
+        """ Keys that are not valid XML names are made valid like dicttoxml does """
+        meta = {'1abc': 'x', '12': 'y', 'Short Name': 'z', 'a&b': ['v']}
+        xml = helpers.dict_to_xml(meta, root=None)
+        self.assertEqual(xml, (
+            '<key name="1abc">x</key><n12>y</n12><Short_Name>z</Short_Name>'
+            '<key name="a&amp;b"><item>v</item></key>'
+        ))
+        parseString('<Granule>%s</Granule>' % xml)
+
+    def test_write_metadata(self):
+        """ Write metadata directly to an XML file """
+        fout = os.path.join(self.path, 'test.meta.xml')
+        helpers.write_metadata({'key1': 'val1'}, fout, pretty=True)
+        with open(fout) as f:
+            self.assertEqual(f.read(), helpers.dict_to_xml({'key1': 'val1'}, pretty=True))
@@ -0,0 +1,18 @@
+import unittest
+from benchmarks import bench_imports
+
+
+class TestImports(unittest.TestCase):
+    """ Test import time of the package """
+
+    def test_lazy_imports(self):
+        """ Heavy dependencies are imported on first use """
+        elapsed, modules = bench_imports.import_time()
+        self.assertEqual(bench_imports.eager(modules), [])
+
+    def test_lazy_process(self):
+        """ Importing the package does not import Process """
+        elapsed, modules = bench_imports.import_time('cumulus_process')
+        self.assertFalse('cumulus_process.process' in modules)
+        from cumulus_process import Process
+        self.assertEqual(Process.__module__, 'cumulus_process.process')
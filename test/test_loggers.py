@@ -1,14 +1,37 @@
-
+import io
+import os
+import json
 import logging
+import datetime
+import threading
 import unittest
-from ast import literal_eval
+from tempfile import mkdtemp
 from testfixtures import log_capture, compare, Comparison as C
-from cumulus_process.loggers import getLogger
+from cumulus_process import loggers
+from cumulus_process.loggers import getLogger, CumulusFormatter, ContextAdapter, RateLimitFilter, BoundedQueueHandler
 
 
 class TestLoggers(unittest.TestCase):
     ''' Test Cumulus logger '''
 
+    def setUp(self):
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        getLogger(__name__)
+
+    def logger(self, level=logging.INFO, **kwargs):
+        """ Cumulus logger also writing formatted records to self.stream """
+        logger = getLogger(__name__, stdout=dict(level=level, **kwargs))
+        if kwargs.get('async'):
+            loggers._listeners[__name__].handlers[0].setStream(self.stream)
+        else:
+            logger.handlers[0].setStream(self.stream)
+        return logger
+
+    def records(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
     def test_config(self):
         """ Check configuration of logger """
         # null handler
@@ -25,25 +48,162 @@ class TestLoggers(unittest.TestCase):
     @log_capture()
     def test_logger(self, lc):
         """ Stream logger """
-        logger = getLogger(__name__, stdout={'level': logging.INFO})
-        logger.info('test message')
+        logger = self.logger()
+        logger.info('test %s', 'message')
         vals = [v for v in lc.actual()][0]
-        self.assertEqual(vals[0], __name__)
-        self.assertEqual(vals[1], 'INFO')
-        d = literal_eval(vals[2])
+        self.assertEqual(vals, (__name__, 'INFO', 'test message'))
+        d = self.records()[0]
         self.assertEqual(d['message'], 'test message')
+        self.assertEqual(d['level'], 'INFO')
+        self.assertTrue('timestamp' in d.keys())
 
     @log_capture()
     def test_logger_json(self, lc):
         """ Stream logger with JSON output """
-        logger = getLogger(__name__, stdout={'level': logging.INFO})
+        logger = self.logger()
         logger = logging.LoggerAdapter(logger, {'collectionName': 'test_collection'})
-        logger.info({'key1': 'val1', 'key2': 'val2'})
+        msg = {'key1': 'val1', 'key2': 'val2'}
+        logger.info(msg)
+        # the message itself is left unchanged
+        self.assertEqual(msg, {'key1': 'val1', 'key2': 'val2'})
         vals = [v for v in lc.actual()][0]
         self.assertEqual(vals[0], __name__)
         self.assertEqual(vals[1], 'INFO')
-        d = literal_eval(vals[2])
-        self.assertTrue('collectionName' in d.keys())
+        d = self.records()[0]
+        self.assertEqual(d['collectionName'], 'test_collection')
         self.assertTrue('timestamp' in d.keys())
         self.assertEqual(d['message'], '')
         self.assertEqual(d['key1'], 'val1')
+
+    def test_context_adapter(self):
+        """ Add bound context to every record """
+        logger = ContextAdapter(self.logger(), {'collectionName': 'c1', 'granuleId': 'g1'})
+        logger.info('first')
+        logger.warning({'message': 'second', 'size': 1})
+        logger.debug('not written')
+        first, second = self.records()
+        self.assertEqual(first['collectionName'], 'c1')
+        self.assertEqual(first['granuleId'], 'g1')
+        self.assertEqual(second['message'], 'second')
+        self.assertEqual(second['size'], 1)
+        self.assertEqual(second['level'], 'WARNING')
+
+    def test_extra(self):
+        """ Copy extra record attributes, and serialize messages with keys that are not strings """
+        logger = self.logger()
+        logger.info('x', extra={'size': 5})
+        logger.info({1: 'a', None: 'b'})
+        first, second = self.records()
+        self.assertEqual(first['size'], 5)
+        self.assertFalse('args' in first or 'lineno' in first)
+        self.assertEqual(second['1'], 'a')
+        self.assertEqual(second['null'], 'b')
+
+    def test_timestamp(self):
+        """ Timestamps are record creation times """
+        formatter = CumulusFormatter()
+        record = logging.LogRecord(__name__, logging.INFO, __file__, 1, 'message', None, None)
+        record.created = 1500000000.25
+        d = json.loads(formatter.format(record))
+        second = datetime.datetime.fromtimestamp(1500000000).isoformat()
+        self.assertEqual(d['timestamp'], '%s.250000' % second)
+        record.created = 1500000001.5
+        d = json.loads(formatter.format(record))
+        second = datetime.datetime.fromtimestamp(1500000001).isoformat()
+        self.assertEqual(d['timestamp'], '%s.500000' % second)
+
+    def test_exception(self):
+        """ Include tracebacks """
+        logger = self.logger()
+        try:
+            raise ValueError('bad value')
+        except ValueError:
+            logger.exception('failed')
+        d = self.records()[0]
+        self.assertEqual(d['message'], 'failed')
+        self.assertTrue('ValueError: bad value' in d['exc_info'])
+
+
+    def test_async(self):
+        """ Write records from a background thread """
+        logger = self.logger(**{'async': True})
+        self.assertTrue(isinstance(logger.handlers[0], BoundedQueueHandler))
+        msg = {'message': 'dict', 'n': 1}
+        for i in range(100):
+            logger.info('record %s', i)
+        logger.info(msg)
+        logger.debug('not written')
+        try:
+            raise ValueError('bad value')
+        except ValueError:
+            logger.exception('failed')
+        msg['n'] = 2
+        self.assertTrue(loggers.flush(timeout=5))
+        records = self.records()
+        self.assertEqual([r['message'] for r in records[:100]], ['record %s' % i for i in range(100)])
+        self.assertEqual(records[100]['n'], 1)
+        self.assertTrue('ValueError: bad value' in records[101]['exc_info'])
+        self.assertEqual(len(records), 102)
+
+    def test_async_fork(self):
+        """ Write records from a forked child """
+        logger = self.logger(**{'async': True})
+        fout = os.path.join(mkdtemp(), 'log.txt')
+        with open(fout, 'w') as f:
+            loggers._listeners[__name__].handlers[0].setStream(f)
+            logger.info('parent')
+            self.assertTrue(loggers.flush(timeout=5))
+            pid = os.fork()
+            if pid == 0:
+                logger.info('child')
+                os._exit(0 if loggers.flush(timeout=2) else 1)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        with open(fout) as f:
+            self.assertEqual([json.loads(line)['message'] for line in f], ['parent', 'child'])
+
+    def test_async_overflow(self):
+        """ Drop records when the queue is full, and report how many """
+        logger = self.logger(**{'async': True, 'queue_size': 2})
+        listener = loggers._listeners[__name__]
+        # hold the listener thread while filling the queue
+        lock = threading.Lock()
+        lock.acquire()
+        handle = listener.handle
+        listener.handle = lambda record: (lock.acquire(), lock.release(), handle(record))
+        for i in range(10):
+            logger.info('record %s', i)
+        self.assertTrue(logger.handlers[0].dropped >= 7)
+        lock.release()
+        loggers.flush(timeout=5)
+        logger.info('last')
+        loggers.shutdown()
+        messages = [r['message'] for r in self.records()]
+        self.assertEqual(messages[-1], 'last')
+        self.assertTrue(messages[-2].endswith('log records dropped, log queue full'))
+
+    def test_async_invalid_overflow(self):
+        """ Check overflow policy """
+        with self.assertRaises(ValueError):
+            getLogger(__name__, stdout={'level': logging.INFO, 'async': True, 'overflow': 'other'})
+
+    def test_rate_limit(self):
+        """ Sample repeated debug records """
+        logger = self.logger(level=logging.DEBUG, rate_limit=3)
+        for i in range(10):
+            logger.debug('Downloading %s', i)
+            logger.info('Uploading %s', i)
+        records = self.records()
+        self.assertEqual(len([r for r in records if r['level'] == 'DEBUG']), 3)
+        self.assertEqual(len([r for r in records if r['level'] == 'INFO']), 10)
+
+    def test_rate_limit_suppressed(self):
+        """ Report records suppressed since the last one written """
+        f = RateLimitFilter(1)
+        records = []
+        for created in [10.0, 10.5, 10.6, 11.2]:
+            record = logging.LogRecord(__name__, logging.DEBUG, __file__, 1, 'Downloading %s', ('f',), None)
+            record.created = created
+            records.append(f.filter(record))
+        self.assertEqual(records, [True, False, False, True])
+        self.assertEqual(record.suppressed, 2)
@@ -3,9 +3,12 @@ This testing module relies on some testing data available in s3://cumulus-intern
 """
 
 import os
+import time
 import uuid
+import signal
 import json
 import unittest
+from shutil import rmtree
 from tempfile import mkdtemp
 from mock import patch
 import cumulus_process.s3 as s3
@@ -24,6 +27,22 @@ def fake_process(self):
     return self.output
 
 
+class BatchProcess(Process):
+    """ Process failing on inputs named fail, for batch tests """
+
+    def process(self):
+        if any('fail' in f for f in self.input):
+            raise Exception('bad input %s' % self.input)
+        if any('crash' in f for f in self.input):
+            # like the worker being killed when out of memory
+            os.kill(os.getpid(), signal.SIGKILL)
+        if any('slow' in f for f in self.input):
+            time.sleep(0.2)
+        with open(os.path.join(self.path, 'output.txt'), 'w') as f:
+            f.write(str(self.input))
+        return [os.getpid(), self.path, self.input]
+
+
 class Test(unittest.TestCase):
     """ Test utiltiies for publishing data on AWS PDS """
 
@@ -135,9 +154,252 @@ class Test(unittest.TestCase):
             self.assertTrue(os.path.exists(f))
             self.assertTrue(f in output)
 
+    def test_handler_scratch(self):
+        """ Handler reuses an emptied scratch directory across invocations """
+        paths = []
+
+        class ScratchProcess(Process):
+            def process(self):
+                paths.append(self.path)
+                with open(os.path.join(self.path, 'output.txt'), 'w') as f:
+                    f.write(str(os.listdir(self.path)))
+                return []
+
+        event = {'input': self.input_files, 'config': self.test_config}
+        ScratchProcess.handler(event, noclean=True)
+        ScratchProcess.handler(event)
+        self.assertEqual(paths[0], paths[1])
+        # the second invocation started with an empty directory, and emptied it when done
+        self.assertTrue(os.path.isdir(paths[1]))
+        self.assertEqual(os.listdir(paths[1]), [])
+
+    def test_handler_spill(self):
+        """ Large outputs of the handler are spilled to S3, but not those of the inner handler used by wrappers """
+
+        class LargeProcess(Process):
+            def process(self):
+                return ['s3://bucket/file-%s.hdf' % i for i in range(5000)]
+
+        bucket = str(uuid.uuid4())
+        s3.get_client().create_bucket(Bucket=bucket)
+        event = {'input': self.input_files, 'config': self.test_config}
+        with patch('cumulus_process.handlers.SFN_SPILL_URI', 's3://%s/spill' % bucket):
+            pointer = LargeProcess.handler(event)
+            output = LargeProcess._handler(event)
+        self.assertTrue(s3.is_pointer(pointer))
+        self.assertEqual(s3.resolve_pointer(pointer), output)
+        self.assertEqual(len(output), 5000)
+        s3.delete_prefix('s3://%s/' % bucket)
+        s3.get_client().delete_bucket(Bucket=bucket)
+
     def _check_and_remove_remote_out(self, uris):
         """ Check for existence of remote files, then remove them """
         for uri in uris:
             self.assertTrue(s3.exists(uri))
             s3.delete(uri)
             self.assertFalse(s3.exists(uri))
+
+
+class TestFetch(unittest.TestCase):
+    """ Test fetching of remote input files """
+
+    bucket = str(uuid.uuid4())
+    s3path = 's3://%s/testing/cumulus-py' % bucket
+    @classmethod
+    def setUpClass(cls):
+        """ Put some input files up on S3 """
+        cls.input_files = ['%s/input-%s-%s.txt' % (cls.s3path, i, n) for n in (1, 2) for i in range(5)]
+        cls.s3 = s3.get_client()
+        cls.s3.create_bucket(Bucket=cls.bucket)
+        for uri in cls.input_files:
+            cls.s3.put_object(Bucket=cls.bucket, Key=s3.uri_parser(uri)['key'], Body=uri)
+
+    @classmethod
+    def tearDownClass(cls):
+        for uri in cls.input_files:
+            s3.delete(uri)
+        cls.s3.delete_bucket(Bucket=cls.bucket)
+
+    def test_fetch_concurrent(self):
+        """ Fetch files concurrently, keeping input order """
+        process = Process(self.input_files, path=mkdtemp())
+        fnames = process.fetch('input-1', concurrency=4)
+        self.assertEqual([os.path.basename(f) for f in fnames],
+                         [os.path.basename(f) for f in self.input_files[0:5]])
+        self.assertEqual(process.downloads, fnames)
+        with open(fnames[2]) as f:
+            self.assertEqual(f.read(), self.input_files[2])
+        # fetching again does not download again
+        self.assertEqual(process.fetch('input-1'), fnames)
+        self.assertEqual(len(process.downloads), 5)
+        process.clean_all()
+
+    def test_prefetch(self):
+        """ Prefetch all input keys """
+        process = Process(self.input_files, path=mkdtemp())
+        files = process.prefetch(concurrency=4)
+        self.assertEqual(len(files['input-1']), 5)
+        self.assertEqual(len(files['input-2']), 5)
+        self.assertEqual(len(process.downloads), 10)
+        self.assertEqual(process.fetch('input-2'), files['input-2'])
+        process.clean_all()
+
+    def test_fetch_duplicates(self):
+        """ Duplicate inputs are downloaded once """
+        process = Process(self.input_files[0:2] + self.input_files[0:2], path=mkdtemp())
+        fnames = process.fetch('input-1')
+        self.assertEqual(len(fnames), 2)
+        self.assertEqual(process.downloads, fnames)
+        process.clean_all()
+
+    def test_fetch_stream(self):
+        """ Fetch files as streaming file objects """
+        process = Process(self.input_files, path=mkdtemp())
+        files = process.fetch('input-1', remote='stream')
+        self.assertEqual(len(files), 5)
+        self.assertEqual(files[0].read(), self.input_files[0].encode())
+        self.assertEqual(process.downloads, [])
+        for f in files:
+            f.close()
+        process.clean_all()
+
+    def test_fetch_checksums(self):
+        """ Fetch files and their checksums """
+        import hashlib
+        process = Process(self.input_files, path=mkdtemp())
+        fnames = process.fetch('input-1', concurrency=2, checksums=['md5'])
+        self.assertEqual(process.checksums[fnames[0]]['md5'], hashlib.md5(self.input_files[0].encode()).hexdigest())
+        # already downloaded files
+        process.fetch('input-1', checksums=['sha1'])
+        self.assertEqual(sorted(process.checksums[fnames[1]]), ['md5', 'sha1'])
+        process.clean_all()
+
+    def test_fetch_error(self):
+        """ Fetch fails if one of the downloads fails """
+        process = Process(self.input_files + [os.path.join(self.s3path, 'missing-1.txt')], path=mkdtemp())
+        with self.assertRaises(Exception):
+            process.fetch('input-1', concurrency=4)
+        process.clean_all()
+
+    def test_run_stats(self):
+        """ Record timing spans and transfers of a run """
+        runs = []
+
+        class StatsProcess(Process):
+            def process(self):
+                self.fetch('input-1', concurrency=2)
+                self.run_command('true')
+                runs.append(self)
+                return self.output
+
+        with patch.dict(os.environ, {'CUMULUS_STATS': '1'}):
+            StatsProcess.run(self.input_files, path=mkdtemp())
+        summary = runs[0].stats.summary()
+        self.assertEqual(sorted(summary['phases']), ['clean', 'command', 'fetch', 'process'])
+        self.assertEqual(summary['transfers']['download']['count'], 5)
+        self.assertEqual(summary['transfers']['download']['bytes'], sum(len(f) for f in self.input_files[0:5]))
+        command = [span for span in runs[0].stats.spans if span['name'] == 'command'][0]
+        self.assertEqual(command['returncode'], 0)
+        self.assertTrue(command['max_rss'] > 0)
+        emf = runs[0].stats.emf(dimensions={'Process': 'StatsProcess'})
+        self.assertEqual(emf['Process'], 'StatsProcess')
+        self.assertEqual(emf['downloadBytes'], summary['transfers']['download']['bytes'])
+
+    def test_run_commands(self):
+        """ Run commands in parallel, returning their output """
+        process = Process(self.input_files, path=mkdtemp())
+        self.assertEqual(process.run_command('echo "a  b"'), b'a  b\n')
+        self.assertEqual(process.run_commands([['echo', str(i)] for i in range(3)], concurrency=2),
+                         [b'0\n', b'1\n', b'2\n'])
+        with self.assertRaises(RuntimeError):
+            process.run_command('false')
+        with self.assertRaises(RuntimeError):
+            process.run_command('no-such-command')
+        process.clean_all()
+
+    def test_run_no_stats(self):
+        """ Stats are not recorded unless enabled """
+        process = Process(self.input_files, path=mkdtemp())
+        self.assertFalse(process.stats.enabled)
+        process.fetch('input-1')
+        self.assertEqual(process.stats.summary(), {})
+        process.clean_all()
+
+
+class TestBatch(unittest.TestCase):
+    """ Test running many payloads """
+
+    def test_run_many(self):
+        """ Run payloads on a process pool, writing results as JSON lines """
+        payloads = ({'input': ['file-%s.txt' % i]} for i in range(10))
+        fout = os.path.join(mkdtemp(), 'results.jsonl')
+        summary = BatchProcess.run_many(payloads, workers=2, output=fout)
+        self.assertEqual(summary['total'], 10)
+        self.assertEqual(summary['succeeded'], 10)
+        self.assertTrue(summary['throughput'] > 0)
+        with open(fout) as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r['index'] for r in results), list(range(10)))
+        for r in results:
+            pid, path, inputs = r['output']
+            self.assertEqual(inputs, ['file-%s.txt' % r['index']])
+            # scratch directories are emptied after each payload
+            self.assertEqual(os.listdir(path), [])
+
+    def test_run_many_failures(self):
+        """ Failed payloads are reported without stopping the batch """
+        path = mkdtemp()
+        payloads = [{'input': ['file-1.txt']}, {'input': ['fail.txt']}, {'input': ['file-2.txt']}]
+        results = sorted(BatchProcess.iter_many(payloads, workers=1, path=path, noclean=True),
+                         key=lambda r: r['index'])
+        self.assertEqual([r['status'] for r in results], ['succeeded', 'failed', 'succeeded'])
+        self.assertTrue('bad input' in results[1]['error'])
+        # each payload has its own directory under path
+        self.assertEqual(len(os.listdir(path)), 3)
+
+    def test_run_many_worker_died(self):
+        """ Payloads in flight when a worker dies are failed, and the rest run on new workers """
+        payloads = [{'input': ['crash.txt']}] + [{'input': ['slow-%s.txt' % i]} for i in range(1, 10)]
+        results = {r['index']: r for r in BatchProcess.iter_many(payloads, workers=2)}
+        self.assertEqual(sorted(results), list(range(10)))
+        self.assertEqual(results[0]['status'], 'failed')
+        self.assertTrue(results[0]['error'].startswith('BrokenProcessPool'))
+        # at most the payloads in flight (2 per worker) failed
+        failed = [i for i, r in results.items() if r['status'] == 'failed']
+        self.assertTrue(set(failed) <= set(range(4)))
+        self.assertEqual([results[i]['status'] for i in range(4, 10)], ['succeeded'] * 6)
+
+    def test_run_many_unpicklable(self):
+        """ Payloads that can't be sent to workers are failed """
+
+        class LocalProcess(Process):
+            def process(self):
+                return self.input
+
+        summary = LocalProcess.run_many([{'input': ['file-%s.txt' % i]} for i in range(3)], workers=2)
+        self.assertEqual(summary['total'], 3)
+        self.assertEqual(summary['failed'], 3)
+
+    def test_run_many_noclean(self):
+        """ Payloads kept with noclean each have a new directory """
+        payloads = [{'input': ['file-%s.txt' % i]} for i in range(3)]
+        results = list(BatchProcess.iter_many(payloads, workers=1, noclean=True))
+        paths = [r['output'][1] for r in results]
+        self.assertEqual(len(set(paths)), 3)
+        for path in paths:
+            self.assertTrue(os.path.exists(os.path.join(path, 'output.txt')))
+            rmtree(path)
+
+    def test_run_many_s3(self):
+        """ Run payloads stored on S3 """
+        bucket = str(uuid.uuid4())
+        s3.get_client().create_bucket(Bucket=bucket)
+        uris = []
+        for i in range(3):
+            uris.append('s3://%s/messages/%s.json' % (bucket, i))
+            s3.upload_json({'input': ['file-%s.txt' % i]}, uris[-1], extra={})
+        results = sorted(BatchProcess.iter_many(uris, workers=2), key=lambda r: r['index'])
+        self.assertEqual([r['payload'] for r in results], uris)
+        self.assertEqual([r['output'][2] for r in results], [['file-%s.txt' % i] for i in range(3)])
+        s3.delete_prefix('s3://%s/' % bucket)
+        s3.get_client().delete_bucket(Bucket=bucket)
@@ -0,0 +1,108 @@
+import unittest
+from cumulus_process.rules import Matcher, InputIndex, PublishRules
+from cumulus_process import rules
+
+
+class TestRules(unittest.TestCase):
+    """ Test matching of filenames against rules """
+
+    input_keys = {
+        'input-1': r'^.*-1.txt$',
+        'input-2': r'^.*-2.txt$',
+        'txt': r'^.*\.txt$',
+        'from_config': True
+    }
+
+    inputs = [
+        's3://bucket/path/file-1.txt',
+        's3://bucket/path/file-2.txt',
+        's3://bucket/path/file-3.txt',
+        's3://bucket/path/file-1.txt',
+        's3://bucket/path/file.hdf'
+    ]
+
+    def test_matcher(self):
+        """ Match name against all patterns """
+        matcher = Matcher([r'^a', r'^.*b$', r'^c'])
+        self.assertIsNotNone(matcher.combined)
+        self.assertEqual(matcher.match('ab'), [0, 1])
+        self.assertEqual(matcher.match('c'), [2])
+        self.assertEqual(matcher.match('d'), [])
+
+    def test_matcher_backref(self):
+        """ Patterns with back references are matched one at a time """
+        matcher = Matcher([r'^(a)\1', r'^a'])
+        self.assertIsNone(matcher.combined)
+        self.assertEqual(matcher.match('aa'), [0, 1])
+        self.assertEqual(matcher.match('ab'), [1])
+
+    def test_matcher_conditional(self):
+        """ Patterns with conditional group references are matched one at a time """
+        matcher = Matcher([r'^.*\.txt$', r'^(a)?x(?(1)y|z)$'])
+        self.assertIsNone(matcher.combined)
+        self.assertEqual(matcher.match('axy'), [1])
+        self.assertEqual(matcher.match('axz'), [])
+        self.assertEqual(matcher.match('xz'), [1])
+
+    def test_input_index(self):
+        """ Index inputs by key """
+        index = InputIndex(self.input_keys, self.inputs)
+        self.assertEqual(index.get('input-1'), [self.inputs[0]])
+        self.assertEqual(index.get('input-2'), [self.inputs[1]])
+        self.assertEqual(index.get('txt'), self.inputs[0:3])
+        self.assertEqual(index.get('from_config'), [])
+        self.assertTrue(index.is_current(self.input_keys, self.inputs))
+        self.assertFalse(index.is_current(self.input_keys, self.inputs[0:2]))
+
+    config = {
+        'buckets': {
+            'public': {'name': 'public-bucket', 'type': 'public'},
+            'protected': {'name': 'protected-bucket', 'type': 'protected'}
+        },
+        'distribution_endpoint': 'https://example.com',
+        'fileStagingDir': 'staging',
+        'files_config': [
+            {'regex': r'^.*\.hdf$', 'bucket': 'protected'},
+            {'regex': r'^.*\.jpg$'},
+            {'regex': r'^.*\.xml$', 'bucket': 'private'},
+            {'regex': r'^.*\.(txt|jpg)$'}
+        ]
+    }
+
+    def test_publish_rules(self):
+        """ Resolve publishing info for files """
+        rules = PublishRules(self.config)
+        hdf, xml, nomatch = rules.resolve_many(['/tmp/file.hdf', 'file.xml', 'file.met'])
+        self.assertEqual(hdf['s3'], 's3://protected-bucket/staging/file.hdf')
+        self.assertEqual(hdf['http'], 'https://example.com/staging/file.hdf')
+        self.assertEqual(xml, {'regex': r'^.*\.xml$', 'bucket': 'private'})
+        self.assertIsNone(nomatch)
+        txt = rules.resolve('file.txt')
+        self.assertEqual(txt['http'], 'http://public-bucket.s3.amazonaws.com/staging/file.txt')
+        # rules are not modified
+        self.assertNotIn('s3', self.config['files_config'][3])
+
+    def test_publish_rules_ambiguous(self):
+        """ More than one matching rule is an error """
+        with self.assertRaises(Exception):
+            PublishRules(self.config).resolve('file.jpg')
+
+
+class TestCache(unittest.TestCase):
+    """ Test reuse of compiled rules """
+
+    def test_get_matcher(self):
+        """ Matchers are compiled once per list of patterns """
+        matcher = rules.get_matcher([r'^a.*', r'^b.*'])
+        self.assertIs(rules.get_matcher((r'^a.*', r'^b.*')), matcher)
+        self.assertIsNot(rules.get_matcher([r'^b.*']), matcher)
+
+    def test_get_publish_rules(self):
+        """ Publishing rules are compiled once per config """
+        config = {'buckets': {'public': {'name': 'bucket', 'type': 'public'}},
+                  'files_config': [{'regex': r'^.*\.hdf$'}], 'other': 1}
+        publish_rules = rules.get_publish_rules(config)
+        self.assertIs(rules.get_publish_rules(dict(config, other=2)), publish_rules)
+        changed = dict(config, files_config=[{'regex': r'^.*\.xml$'}])
+        self.assertIsNot(rules.get_publish_rules(changed), publish_rules)
+        self.assertEqual(rules.config_hash(config), rules.config_hash(dict(config)))
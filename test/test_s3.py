@@ -1,9 +1,13 @@
 import os
 import uuid
+import zlib
 import json
 import unittest
 import logging
+from shutil import rmtree
+from tempfile import mkdtemp
 from cumulus_process import s3
+from cumulus_process.cache import DownloadCache
 
 # quiet these loggers
 logging.getLogger('boto3').setLevel(logging.CRITICAL)
@@ -41,6 +45,28 @@ class Test(unittest.TestCase):
         self.assertEqual(s3_obj['key'], 'test/file.txt')
         self.assertEqual(s3_obj['filename'], 'file.txt')
 
+    def test_get_client_cached(self):
+        """ Clients are reused for the same service and config """
+        self.assertIs(s3.get_client(), s3.get_client())
+        self.assertIsNot(s3.get_client(), s3.get_client('stepfunctions'))
+        self.assertIsNot(s3.get_client(), s3.get_client(max_pool_connections=2))
+        client = s3.get_client(max_pool_connections=2)
+        self.assertEqual(client.meta.config.max_pool_connections, 2)
+
+    def test_clear_clients(self):
+        """ Clearing the cache creates new clients """
+        client = s3.get_client()
+        s3.clear_clients()
+        self.assertIsNot(client, s3.get_client())
+
+    def test_explicit_client(self):
+        """ Pass an explicit client to s3 functions """
+        client = s3.get_client(max_pool_connections=2)
+        uri = self.s3path + '/explicit.txt'
+        s3.upload(self.payload, uri, client=client)
+        self.assertTrue(s3.exists(uri, client=client))
+        s3.delete(uri, client=client)
+
     def test_exists_true(self):
         """ Check for existence of object that exists """
 
@@ -53,11 +79,119 @@ class Test(unittest.TestCase):
         """ Check for existence of object that doesn't exists """
         self.assertFalse(s3.exists(os.path.join(self.s3path, 'nosuchkey')))
 
+    def test_head(self):
+        """ Get object metadata """
+        uri = self.s3path + '/head.json'
+        s3.upload(self.payload, uri)
+        meta = s3.head(uri)
+        self.assertEqual(meta['size'], os.path.getsize(self.payload))
+        self.assertEqual(meta['storage_class'], 'STANDARD')
+        self.assertIn('etag', meta)
+        self.assertIn('last_modified', meta)
+        self.assertIsNone(s3.head(self.s3path + '/nosuchkey'))
+        s3.delete(uri)
+
+    def test_exists_many(self):
+        """ Check for existence of many objects """
+        uris = [self.s3path + '/many-exists-%s' % i for i in range(6)]
+        for uri in uris[0:3]:
+            s3.upload(self.payload, uri)
+        self.assertEqual(s3.exists_many(uris, workers=3), [True] * 3 + [False] * 3)
+        # results are cached briefly
+        s3.delete(uris[0])
+        self.assertTrue(s3.exists_many(uris[0:1])[0])
+        self.assertFalse(s3.exists_many(uris[0:1], ttl=0)[0])
+        # uris may be any iterable
+        self.assertEqual(s3.exists_many((u for u in uris), ttl=0), [False] + [True] * 2 + [False] * 3)
+        self.assertEqual(len(s3.head_many(iter(uris))), 6)
+        for uri in uris[1:3]:
+            s3.delete(uri)
+
     def test_list_nothing(self):
         """ Get list of objects under a non-existent path on S3 """
         uris = s3.list_objects(os.path.join(self.s3path, 'nosuchkey'))
         self.assertEqual(len(uris), 0)
 
+    def test_iter_objects(self):
+        """ List objects across pages and in parallel """
+        prefix = 'listing'
+        keys = ['%s/%s/file-%s.txt' % (prefix, d, i) for d in ('a', 'b', 'c') for i in range(5)]
+        keys.append('%s/top.txt' % prefix)
+        for key in keys:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=key)
+        uri = 's3://%s/%s' % (self.bucket, prefix)
+        objects = list(s3.iter_objects(uri, page_size=4))
+        self.assertEqual([o['key'] for o in objects], sorted(keys))
+        self.assertEqual(objects[0]['size'], len(objects[0]['key']))
+        self.assertEqual(len(s3.list_objects(uri)), len(keys))
+        objects = list(s3.iter_objects(uri + '/', delimiter='/', page_size=2, workers=2))
+        self.assertEqual(sorted(o['key'] for o in objects), sorted(keys))
+        objects = list(s3.iter_objects(uri, prefixes=['/a/', '/c/']))
+        self.assertEqual(len(objects), 10)
+        # stop part way through a parallel listing
+        it = s3.iter_objects(uri, prefixes=['/a/', '/b/', '/c/'], page_size=1, workers=1)
+        next(it)
+        it.close()
+        for key in keys:
+            s3.delete('s3://%s/%s' % (self.bucket, key))
+
+    def test_delete_many(self):
+        """ Delete objects in batches """
+        uris = [self.s3path + '/delete-many/file-%s' % i for i in range(7)]
+        for uri in uris:
+            s3.upload(self.payload, uri)
+        s3.MAX_DELETE_KEYS = 3
+        try:
+            results = s3.delete_many(uris[0:5], workers=2)
+        finally:
+            s3.MAX_DELETE_KEYS = 1000
+        self.assertEqual([r['uri'] for r in results], uris[0:5])
+        self.assertTrue(all(r['deleted'] for r in results))
+        self.assertEqual(s3.list_objects(self.s3path + '/delete-many/'), uris[5:])
+        s3.delete_many(uris[5:])
+        # missing bucket
+        results = s3.delete_many(['s3://%s/key' % uuid.uuid4()])
+        self.assertFalse(results[0]['deleted'])
+        self.assertIsNotNone(results[0]['error'])
+
+    def test_delete_prefix(self):
+        """ Delete all objects under a path """
+        uris = [self.s3path + '/delete-prefix/file-%s' % i for i in range(4)]
+        for uri in uris:
+            s3.upload(self.payload, uri)
+        results = s3.delete_prefix(self.s3path + '/delete-prefix/')
+        self.assertEqual(len(results), 4)
+        self.assertEqual(s3.list_objects(self.s3path + '/delete-prefix/'), [])
+
+    def test_copy_move(self):
+        """ Copy and move objects server-side """
+        src = self.s3path + '/copy/src.json'
+        s3.upload(self.payload, src)
+        dst = s3.copy(src, self.s3path + '/copy/dst.json')
+        self.assertEqual(dst, self.s3path + '/copy/dst.json')
+        self.assertTrue(s3.exists(src))
+        moved = s3.move(dst, self.s3path + '/copy/moved.json')
+        self.assertFalse(s3.exists(dst))
+        self.assertEqual(s3.head(moved)['size'], os.path.getsize(self.payload))
+        dsts = s3.copy_many([src, moved], [self.s3path + '/copy/many-1', self.s3path + '/copy/many-2'])
+        self.assertEqual(dsts, [self.s3path + '/copy/many-1', self.s3path + '/copy/many-2'])
+        with self.assertRaises(Exception):
+            s3.copy(self.s3path + '/copy/nosuchkey', dst)
+        s3.delete_prefix(self.s3path + '/copy/')
+
+    def test_copy_parts(self):
+        """ Copy large objects in parts """
+        data = os.urandom(11 * s3.MB)
+        self.s3.put_object(Bucket=self.bucket, Key='test/large.bin', Body=data)
+        s3.MAX_COPY_SIZE, s3.COPY_PART_SIZE = 1, 5 * s3.MB
+        try:
+            dst = s3.copy(self.s3path + '/large.bin', self.s3path + '/large-copy.bin', workers=3)
+        finally:
+            s3.MAX_COPY_SIZE, s3.COPY_PART_SIZE = 5 * 1024 * s3.MB, 512 * s3.MB
+        body = self.s3.get_object(Bucket=self.bucket, Key='test/large-copy.bin')['Body'].read()
+        self.assertEqual(body, data)
+        s3.delete_many([self.s3path + '/large.bin', dst])
+
     def test_upload(self):
         """ Upload file to S3 then delete """
         filename = os.path.basename(__file__)
@@ -66,6 +200,26 @@ class Test(unittest.TestCase):
         self.assertEqual(uri, s3_uri)
         s3.delete(s3_uri)
 
+    def test_transfer_config(self):
+        """ Transfer settings picked from object size """
+        small = s3.transfer_config(1024)
+        self.assertEqual(small.max_concurrency, 1)
+        self.assertIs(small, s3.transfer_config(2048))
+        large = s3.transfer_config(2 * 1024 * s3.MB)
+        self.assertEqual(large.multipart_chunksize, 64 * s3.MB)
+        huge = s3.transfer_config(s3.MAX_PARTS * 100 * s3.MB)
+        self.assertEqual(huge.multipart_chunksize, 100 * s3.MB)
+
+    def test_upload_many(self):
+        """ Upload several files in parallel """
+        uris = [self.s3path + '/many-%s.json' % i for i in range(4)]
+        results = s3.upload_many([self.payload] * 4, uris, workers=4)
+        self.assertEqual([r['uri'] for r in results], uris)
+        self.assertEqual(results[0]['bytes'], os.path.getsize(self.payload))
+        for uri in uris:
+            self.assertTrue(s3.exists(uri))
+            s3.delete(uri)
+
     def test_download(self):
         """ Download file from S3 """
         # first upload something
@@ -77,6 +231,47 @@ class Test(unittest.TestCase):
         s3.delete(uri)
         os.remove(fout)
 
+    def test_download_cache(self):
+        """ Download file through the local cache """
+        uri = self.s3path + '/cached.txt'
+        s3.upload(self.payload, uri)
+        path = mkdtemp()
+        cache = DownloadCache(os.path.join(path, 'cache'))
+        fout = s3.download(uri, path=os.path.join(path, 'out-1'), cache=cache)
+        s3.download(uri, path=os.path.join(path, 'out-2'), cache=cache)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['hits'], 1)
+        with open(self.payload) as f1, open(fout) as f2:
+            self.assertEqual(f1.read(), f2.read())
+        # a new version is downloaded again
+        s3.upload(__file__, uri)
+        s3.download(uri, path=os.path.join(path, 'out-3'), cache=cache)
+        self.assertEqual(cache.stats['misses'], 2)
+        s3.delete(uri)
+        rmtree(path)
+
+    def test_checksums(self):
+        """ Compute checksums while uploading and downloading """
+        import hashlib
+        with open(self.payload, 'rb') as f:
+            data = f.read()
+        md5 = hashlib.md5(data).hexdigest()
+        sha256 = hashlib.sha256(data).hexdigest()
+        uri, checksums = s3.upload(self.payload, self.s3path + '/checksums.json', checksums=['md5', 'sha256'])
+        self.assertEqual(checksums, {'md5': md5, 'sha256': sha256})
+        path = mkdtemp()
+        fout, checksums = s3.download(uri, path=path, checksums=['md5', 'sha256', 'crc32'])
+        self.assertEqual(checksums['md5'], md5)
+        self.assertEqual(checksums['sha256'], sha256)
+        self.assertEqual(checksums['crc32'], '%08x' % zlib.crc32(data))
+        # checksums of cached files
+        cache = DownloadCache(os.path.join(path, 'cache'))
+        for i in range(2):
+            fout, checksums = s3.download(uri, path=os.path.join(path, str(i)), cache=cache, checksums=['md5'])
+            self.assertEqual(checksums, {'md5': md5})
+        s3.delete(uri)
+        rmtree(path)
+
     def test_download_json(self):
         """ Download file from S3 as JSON """
         json_obj = {
@@ -90,6 +285,22 @@ class Test(unittest.TestCase):
         self.assertEqual(out, json_obj)
         s3.delete('s3://%s/prefix/test.json' % self.bucket)
 
+    def test_upload_json(self):
+        """ Upload compressed JSON and resolve pointers to it """
+        obj = {'files': ['file-%s' % i for i in range(100)]}
+        uri = 's3://%s/prefix/payload.json.gz' % self.bucket
+        pointer = s3.upload_json(obj, uri, compression='gzip')
+        self.assertTrue(s3.is_pointer(pointer))
+        self.assertEqual(pointer['size'], len(json.dumps(obj)))
+        self.assertEqual(s3.download_json(uri), obj)
+        self.assertEqual(s3.resolve_pointer(pointer), obj)
+        self.assertEqual(s3.resolve_pointer(obj), obj)
+        # a pointer stored on S3 is followed
+        s3.upload_json(pointer, self.s3path + '/pointer.json')
+        self.assertEqual(s3.download_json(self.s3path + '/pointer.json'), obj)
+        s3.delete(uri)
+        s3.delete(self.s3path + '/pointer.json')
+
     def test_download_with_extra_args(self):
         """ Download file from S3 with ExtraArgs """
         uri = self.s3path + '/file.txt'
@@ -0,0 +1,68 @@
+import time
+import threading
+import unittest
+from cumulus_process import stats
+from cumulus_process.pool import run_all
+
+
+class TestStats(unittest.TestCase):
+    """ Test run stats """
+
+    def test_spans(self):
+        """ Total time by span name """
+        st = stats.Stats()
+        with st.span('fetch'):
+            time.sleep(0.01)
+        with st.span('fetch', key='input-1'):
+            pass
+        st.add_span('upload', 2.0)
+        summary = st.summary()
+        self.assertTrue(summary['phases']['fetch'] >= 0.01)
+        self.assertEqual(summary['phases']['upload'], 2.0)
+        self.assertEqual(st.spans[1]['key'], 'input-1')
+
+    def test_transfers(self):
+        """ Totals and throughput by transfer operation """
+        st = stats.Stats()
+        st.transfer('download', 's3://bucket/a', 100, 1.0)
+        st.transfer('download', 's3://bucket/b', 300, 1.0)
+        st.retry(2)
+        summary = st.summary()
+        self.assertEqual(summary['transfers']['download'], {'count': 2, 'bytes': 400, 'elapsed': 2.0, 'throughput': 200})
+        self.assertEqual(summary['retries'], 2)
+
+    def test_emf(self):
+        """ Summary in CloudWatch Embedded Metric Format """
+        st = stats.Stats()
+        st.add_span('process', 1.5)
+        st.transfer('upload', 's3://bucket/a', 100, 0.5)
+        record = st.emf(dimensions={'Process': 'Test'}, namespace='Test')
+        metrics = record['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual(metrics['Namespace'], 'Test')
+        self.assertEqual(metrics['Dimensions'], [['Process']])
+        self.assertEqual(record['processTime'], 1500)
+        self.assertEqual(record['uploadThroughput'], 200)
+        for metric in metrics['Metrics']:
+            self.assertTrue(metric['Name'] in record)
+
+    def test_current(self):
+        """ Activated stats are current in the context and in pool threads """
+        self.assertIs(stats.current(), stats.NULL)
+        st = stats.Stats()
+        with st.activate():
+            self.assertIs(stats.current(), st)
+            self.assertEqual(run_all(lambda i: stats.current(), range(4), workers=4), [st] * 4)
+            # a thread outside of the context, with a single run in progress
+            found = []
+            t = threading.Thread(target=lambda: found.append(stats.current()))
+            t.start()
+            t.join()
+            self.assertEqual(found, [st])
+        self.assertIs(stats.current(), stats.NULL)
+
+    def test_null(self):
+        """ Disabled stats record nothing """
+        with stats.NULL.activate():
+            with stats.NULL.span('fetch'):
+                stats.NULL.transfer('download', 's3://bucket/a', 100, 1.0)
+        self.assertEqual(stats.NULL.summary(), {})
@@ -0,0 +1,63 @@
+import os
+import io
+import uuid
+import zipfile
+import unittest
+from cumulus_process import s3
+from cumulus_process.stream import S3File
+
+if not os.getenv('LOCALSTACK_HOST'):
+    raise Exception('LOCALSTACK_HOST must be set as env variable before running tests')
+
+
+class TestS3File(unittest.TestCase):
+    """ Test streaming S3 objects with ranged reads """
+
+    bucket = str(uuid.uuid4())
+    data = os.urandom(10000)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.s3 = s3.get_client()
+        cls.s3.create_bucket(Bucket=cls.bucket)
+        cls.s3.put_object(Bucket=cls.bucket, Key='data.bin', Body=cls.data)
+        cls.uri = 's3://%s/data.bin' % cls.bucket
+
+    @classmethod
+    def tearDownClass(cls):
+        for uri in s3.list_objects('s3://%s' % cls.bucket):
+            s3.delete(uri)
+        cls.s3.delete_bucket(Bucket=cls.bucket)
+
+    def test_read(self):
+        """ Read across block boundaries """
+        with S3File(self.uri, block_size=1000, max_blocks=4) as f:
+            self.assertEqual(f.size, len(self.data))
+            self.assertEqual(f.read(10), self.data[0:10])
+            f.seek(950)
+            self.assertEqual(f.read(2500), self.data[950:3450])
+            f.seek(-5, os.SEEK_END)
+            self.assertEqual(f.read(), self.data[-5:])
+            self.assertEqual(f.read(10), b'')
+            f.seek(0)
+            self.assertEqual(f.read(), self.data)
+
+    def test_block_cache(self):
+        """ Cached blocks are not requested again """
+        with S3File(self.uri, block_size=1000, readahead=0) as f:
+            f.read(100)
+            f.seek(200)
+            f.read(100)
+            self.assertEqual(f.requests, 1)
+
+    def test_zipfile(self):
+        """ Read a member of a zip file without downloading all of it """
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            z.writestr('a.txt', self.data)
+            z.writestr('b.txt', b'small member')
+        self.s3.put_object(Bucket=self.bucket, Key='data.zip', Body=buf.getvalue())
+        with S3File('s3://%s/data.zip' % self.bucket, block_size=512, readahead=0) as f:
+            with zipfile.ZipFile(f) as z:
+                self.assertEqual(z.read('b.txt'), b'small member')
+            self.assertTrue(f.requests < len(buf.getvalue()) // 512)
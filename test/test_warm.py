@@ -0,0 +1,42 @@
+import os
+import threading
+import unittest
+from cumulus_process import warm
+
+
+class TestWarm(unittest.TestCase):
+    """ Test state reused across invocations """
+
+    def test_invocation(self):
+        """ Count invocations, only the first is cold """
+        first = warm.invocation()
+        second = warm.invocation()
+        self.assertEqual(second['invocation'], first['invocation'] + 1)
+        self.assertFalse(second['cold'])
+        self.assertTrue(second['container_age'] >= 0)
+
+    def test_scratch_dir(self):
+        """ Reuse and empty the scratch directory """
+        path = warm.scratch_dir()
+        self.assertTrue(warm.is_scratch(path))
+        os.makedirs(os.path.join(path, 'sub'))
+        with open(os.path.join(path, 'sub', 'file.txt'), 'w') as f:
+            f.write('file')
+        with open(os.path.join(path, 'file.txt'), 'w') as f:
+            f.write('file')
+        self.assertEqual(warm.scratch_dir(), path)
+        self.assertEqual(os.listdir(path), [])
+
+    def test_scratch_dir_threads(self):
+        """ Each thread has its own scratch directory """
+        paths = []
+        t = threading.Thread(target=lambda: paths.append(warm.scratch_dir()))
+        t.start()
+        t.join()
+        self.assertNotEqual(paths[0], warm.scratch_dir())
+        self.assertFalse(warm.is_scratch(paths[0]))
+
+    def test_prewarm(self):
+        """ Create clients ahead of use """
+        clients = warm.prewarm(services=('s3', 'stepfunctions'))
+        self.assertEqual(sorted(clients), ['s3', 'stepfunctions'])